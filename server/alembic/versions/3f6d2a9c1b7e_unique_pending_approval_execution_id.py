@@ -0,0 +1,44 @@
+"""Unique index on pending_approvals.execution_id
+
+Revision ID: 3f6d2a9c1b7e
+Revises: 
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6d2a9c1b7e'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Scheduled runs used to reuse the schedule id as execution_id. Keep the newest row (by
+    # created_at) of each duplicate group and suffix the others with their row id so the
+    # index can be built.
+    op.execute(sa.text(
+        "UPDATE pending_approvals SET execution_id = execution_id || ':' || id "
+        "WHERE id IN ("
+        "  SELECT id FROM ("
+        "    SELECT id, ROW_NUMBER() OVER ("
+        "      PARTITION BY execution_id ORDER BY created_at DESC, id DESC"
+        "    ) AS rn FROM pending_approvals"
+        "  ) ranked WHERE rn > 1"
+        ")"
+    ))
+    op.execute(sa.text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_pending_approval_execution_id "
+        "ON pending_approvals (execution_id)"
+    ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_pending_approval_execution_id', table_name='pending_approvals')
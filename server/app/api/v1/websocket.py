@@ -6,7 +6,9 @@ from app.services.agent_manager import AgentManager
 from app.services.data_manager import DataManager
 from app.core.dependencies import get_agent_manager, get_data_manager
 from app.models.agent import AgentCreate
+from app.models.db import AuditLog
 import json
+import orjson
 import logging
 
 router = APIRouter()
@@ -102,11 +104,11 @@ async def websocket_endpoint(
             return
         
         # Send Handshake Success
-        await websocket.send_text(json.dumps({
+        await websocket.send_text(orjson.dumps({
             "jsonrpc": "2.0",
             "result": {"status": "registered", "agent_id": agent_id},
             "id": message.get("id")
-        }))
+        }).decode())
 
         # --- SYNC POLICY ON CONNECT ---
         try:
@@ -122,36 +124,36 @@ async def websocket_endpoint(
             logger.debug(f"Received message from {agent_id}: {data}")
             
             try:
-                msg = json.loads(data)
-                
-                # Check if it is a Result to a Command
-                if "id" in msg and ("result" in msg or "error" in msg):
-                    request_id = msg.get("id")
+                payload = orjson.loads(data)
+                # JSON-RPC allows several responses to arrive as one array
+                for msg in (payload if isinstance(payload, list) else (payload,)):
+                    # Check if it is a Result to a Command
+                    if "id" in msg and ("result" in msg or "error" in msg):
+                        request_id = msg.get("id")
                     
-                    # Notify any waiting futures in AgentManager
-                    agent_manager.resolve_response(request_id, msg)
+                        # Notify any waiting futures in AgentManager
+                        agent_manager.resolve_response(request_id, msg)
                     
-                    # --- FIXED: Use a fresh DB session for this update ---
-                    db = data_manager.SessionLocal()
-                    try:
-                        from app.models.db import AuditLog
-                        audit_entry = db.query(AuditLog).filter(AuditLog.id == request_id).first()
-                        if audit_entry:
-                            if "error" in msg:
-                                audit_entry.status = "error"
-                                audit_entry.result = msg.get("error")
-                            else:
-                                audit_entry.status = "success"
-                                audit_entry.result = msg.get("result")
+                        # --- FIXED: Use a fresh DB session for this update ---
+                        db = data_manager.SessionLocal()
+                        try:
+                            audit_entry = db.query(AuditLog).filter(AuditLog.id == request_id).first()
+                            if audit_entry:
+                                if "error" in msg:
+                                    audit_entry.status = "error"
+                                    audit_entry.result = msg.get("error")
+                                else:
+                                    audit_entry.status = "success"
+                                    audit_entry.result = msg.get("result")
                             
-                            audit_entry.completed_at = datetime.utcnow()
-                            db.commit()
-                            logger.info(f"Updated AuditLog {request_id} with result.")
-                    except Exception as db_e:
-                        logger.error(f"Database error updating audit log: {db_e}")
-                        db.rollback() # Important: Rollback on error
-                    finally:
-                        db.close()    # Important: Close session
+                                audit_entry.completed_at = datetime.utcnow()
+                                db.commit()
+                                logger.info(f"Updated AuditLog {request_id} with result.")
+                        except Exception as db_e:
+                            logger.error(f"Database error updating audit log: {db_e}")
+                            db.rollback() # Important: Rollback on error
+                        finally:
+                            db.close()    # Important: Close session
 
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
@@ -1,6 +1,7 @@
 from functools import lru_cache
 from app.services.data_manager import DataManager
 from app.services.agent_manager import AgentManager
+from app.services import model_manager, llm_service
 from app.services.model_manager import ModelManager
 from app.services.llm_service import LLMService
 # Import Scheduler only inside the function to avoid circular imports if necessary, 
@@ -18,13 +19,12 @@ def get_data_manager() -> DataManager:
 def get_agent_manager() -> AgentManager:
     return AgentManager()
 
-@lru_cache()
+# Share the services' own singletons so loaded-model state is seen everywhere
 def get_model_manager() -> ModelManager:
-    return ModelManager()
+    return model_manager.get_model_manager()
 
-@lru_cache()
 def get_llm_service() -> LLMService:
-    return LLMService()
+    return llm_service.get_llm_service()
 
 # Scheduler singleton
 _scheduler = None
@@ -1,12 +1,22 @@
-import json
+import orjson
 import logging
 import asyncio
+import re
 import uuid
 from typing import Dict, Any, Optional
 from app.models.agent import AgentCreate
+from app.models.db import AuditLog
+from app.services.errors import ApprovalRequiredError
 
 logger = logging.getLogger(__name__)
 
+# JSON-RPC error code sent by agents when an action needs human approval
+APPROVAL_REQUIRED_CODE = -32001
+
+# Legacy agents only mention the execution id inside the error message text
+_EXEC_ID_RE = re.compile(r'execution_id"?\s*[:=]\s*"?([\w-]+)')
+
+
 class AgentManager:
     def __init__(self):
         self.active_connections: Dict[str, Any] = {} # agent_id -> WebSocket
@@ -49,7 +59,7 @@ class AgentManager:
         }
         
         try:
-            await websocket.send_text(json.dumps(json_rpc_request))
+            await websocket.send_bytes(orjson.dumps(json_rpc_request))
             logger.info(f"Synced policy to agent {agent_id}")
         except Exception as e:
             logger.error(f"Failed to sync policy to {agent_id}: {e}")
@@ -86,7 +96,6 @@ class AgentManager:
         
         # Save to Audit Log
         if db:
-            from app.models.db import AuditLog
             audit_entry = AuditLog(
                 id=request_id,
                 agent_id=agent_id,
@@ -102,7 +111,7 @@ class AgentManager:
         self.pending_responses[request_id] = future
         
         try:
-            await websocket.send_text(json.dumps(json_rpc_request))
+            await websocket.send_bytes(orjson.dumps(json_rpc_request))
             logger.info(f"Sent {tool_name} to {agent_id} (req_id: {request_id}, approved_by: {approved_by})")
             
             # Wait for response with timeout (30 seconds)
@@ -120,7 +129,18 @@ class AgentManager:
         if request_id in self.pending_responses:
             future = self.pending_responses[request_id]
             if "error" in response:
-                future.set_exception(Exception(response["error"].get("message", "Unknown error")))
+                error = response["error"]
+                if error.get("code") == APPROVAL_REQUIRED_CODE:
+                    data = error.get("data")
+                    data = data if isinstance(data, dict) else {}
+                    message = error.get("message", "Action requires human approval")
+                    execution_id = data.get("execution_id")
+                    if not execution_id:
+                        match = _EXEC_ID_RE.search(message)
+                        execution_id = match.group(1) if match else None
+                    future.set_exception(ApprovalRequiredError(execution_id, data, message))
+                else:
+                    future.set_exception(Exception(error.get("message", "Unknown error")))
             else:
                 future.set_result(response.get("result"))
         else:
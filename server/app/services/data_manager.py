@@ -1,14 +1,77 @@
 # server/app/services/data_manager.py
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, func, select, text
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.models.db import Base, Agent, AuditLog, User, GlobalSettings, ChatSession, ChatMessage, Schedule, PendingApproval
 from datetime import datetime, timedelta
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
 import os
 import logging
+import threading
+import time
 import json
 
 logger = logging.getLogger(__name__)
 
+# Pending chat writes for the current task while inside DataManager.transaction()
+_chat_write_buffer: ContextVar[Optional[dict]] = ContextVar("_chat_write_buffer", default=None)
+
+# Connection pool sizing shared by the sync and async engines
+POOL_OPTIONS = {"pool_size": 20, "max_overflow": 10, "pool_pre_ping": True, "pool_recycle": 1800}
+
+# How long get_agent_policy() results are reused, and how many agents are kept
+POLICY_CACHE_TTL = 60.0
+POLICY_CACHE_SIZE = 256
+
+# How long the agent id -> hostname map from get_agent_names() is reused
+AGENT_NAMES_TTL = 30.0
+
+# Before execution_id was made unique, scheduled runs reused their schedule id as the
+# execution_id. Keep the newest row (by created_at) of each duplicate group as-is and suffix
+# the others with their own (unique) row id, so the unique index can be built without losing rows.
+# Mirrored by the alembic revision that adds the index.
+_DEDUPE_EXECUTION_IDS = text(
+    "UPDATE pending_approvals SET execution_id = execution_id || ':' || id "
+    "WHERE id IN ("
+    "  SELECT id FROM ("
+    "    SELECT id, ROW_NUMBER() OVER ("
+    "      PARTITION BY execution_id ORDER BY created_at DESC, id DESC"
+    "    ) AS rn FROM pending_approvals"
+    "  ) ranked WHERE rn > 1"
+    ")"
+)
+_UNIQUE_EXECUTION_ID_INDEX = text(
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_pending_approval_execution_id "
+    "ON pending_approvals (execution_id)"
+)
+
+# Async drivers used for the AsyncSession engine, keyed by the sync URL dialect
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _async_db_url(db_url: str) -> str:
+    """Rewrite a sync database URL to use the matching async driver."""
+    scheme, rest = db_url.split("://", 1)
+    return f"{_ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets commits append to the log without blocking concurrent readers, and
+    synchronous=NORMAL only fsyncs at checkpoints (safe against corruption in WAL mode).
+    busy_timeout makes concurrent writers wait their turn instead of failing as locked.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 class DataManager:
     def __init__(self, db_url=None):
         if db_url is None:
@@ -17,10 +80,22 @@ class DataManager:
         if "sqlite" in db_url:
             connect_args = {"check_same_thread": False}
         
-        self.engine = create_engine(db_url, connect_args=connect_args)
+        self.engine = create_engine(db_url, connect_args=connect_args, **POOL_OPTIONS)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Async engine for queries issued from async handlers (tools, scheduler)
+        self.async_engine = create_async_engine(_async_db_url(db_url), **POOL_OPTIONS)
+        if "sqlite" in db_url:
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
+            event.listen(self.async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        # agent_id -> (expires_at, (policy, normalized policy)); policies change on human timescales
+        self._policy_cache: Dict[str, Tuple[float, Tuple[dict, dict]]] = {}
+        self._policy_lock = threading.Lock()
+        # (expires_at, {agent_id: hostname}); dropped whenever an agent registers
+        self._agent_names: Optional[Tuple[float, Dict[str, str]]] = None
         Base.metadata.create_all(bind=self.engine)
         self._run_migrations()
+        self._ensure_unique_execution_ids()
 
     def _run_migrations(self):
         """Add missing columns safely if they don't exist"""
@@ -85,10 +160,24 @@ class DataManager:
                 self._migrate_table(conn, is_sqlite, 'pending_approvals', [
                     ("session_id", "VARCHAR", "ALTER TABLE pending_approvals ADD COLUMN session_id VARCHAR"),
                 ])
-                             
+
         except Exception as e:
             logger.warning(f"Global migration error: {e}")
 
+    def _ensure_unique_execution_ids(self):
+        """
+        One pending approval per execution. pending_approval_insert() relies on this index
+        for ON CONFLICT (execution_id), so failing to build it is fatal rather than a warning.
+        """
+        try:
+            with self.engine.begin() as conn:
+                deduped = conn.execute(_DEDUPE_EXECUTION_IDS).rowcount
+                conn.execute(_UNIQUE_EXECUTION_ID_INDEX)
+        except Exception as e:
+            raise RuntimeError(f"Could not create unique index on pending_approvals.execution_id: {e}") from e
+        if deduped:
+            logger.info(f"Migration: Renamed {deduped} duplicate pending_approvals.execution_id values.")
+
     def _migrate_table(self, conn, is_sqlite: bool, table_name: str, columns: list):
         """Helper to add missing columns to a table."""
         try:
@@ -141,6 +230,15 @@ class DataManager:
         finally:
             db.close()
 
+    def get_async_db(self) -> AsyncSession:
+        """New AsyncSession; use as `async with dm.get_async_db() as s:`."""
+        return self.AsyncSessionLocal()
+
+    def pending_approval_insert(self, **values):
+        """INSERT statement for a PendingApproval that does nothing if its execution_id already exists."""
+        insert = pg_insert if self.engine.dialect.name == "postgresql" else sqlite_insert
+        return insert(PendingApproval).values(**values).on_conflict_do_nothing(index_elements=["execution_id"])
+
     def register_agent(self, agent_data: dict):
         db = self.SessionLocal()
         try:
@@ -152,10 +250,24 @@ class DataManager:
                 for key, value in agent_data.items():
                     setattr(agent, key, value)
             db.commit()
+            self._agent_names = None
             return agent
         finally:
             db.close()
 
+    def get_agent_names(self) -> Dict[str, str]:
+        """Map of agent id -> hostname, cached for AGENT_NAMES_TTL seconds. Treat as read-only."""
+        cached = self._agent_names
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        db = self.SessionLocal()
+        try:
+            names = dict(db.execute(select(Agent.id, Agent.hostname)).all())
+        finally:
+            db.close()
+        self._agent_names = (time.monotonic() + AGENT_NAMES_TTL, names)
+        return names
+
     def update_agent_status(self, agent_id: str, status: str):
         db = self.SessionLocal()
         try:
@@ -173,8 +285,15 @@ class DataManager:
         try:
             agent = db.query(Agent).filter(Agent.id == agent_id).first()
             if agent:
+                # Store command lists stripped and lowercased so readers can match them as-is
+                policy = dict(policy)
+                for key in ("requires_approval_for", "blocked_commands"):
+                    if key in policy:
+                        policy[key] = [x.strip().lower() for x in policy[key] if x.strip()]
                 agent.security_policy_json = json.dumps(policy)
                 db.commit()
+                with self._policy_lock:
+                    self._policy_cache.pop(agent_id, None)
                 return True
             return False
         except Exception as e:
@@ -185,14 +304,78 @@ class DataManager:
             db.close()
 
     def get_agent_policy(self, agent_id: str) -> dict:
+        """Agent's security policy, cached for POLICY_CACHE_TTL seconds. Treat as read-only."""
+        return self._get_policy_entry(agent_id)[0]
+
+    def get_normalized_policy(self, agent_id: str) -> dict:
+        """
+        Agent's policy in the form the tool executor matches against: hitl_enabled as a bool,
+        requires_approval and blocked_commands as lowercase frozensets. Built once per
+        POLICY_CACHE_TTL alongside get_agent_policy(). Treat as read-only.
+        """
+        return self._get_policy_entry(agent_id)[1]
+
+    def _get_policy_entry(self, agent_id: str) -> Tuple[dict, dict]:
+        now = time.monotonic()
+        with self._policy_lock:
+            entry = self._policy_cache.get(agent_id)
+            if entry and entry[0] > now:
+                return entry[1]
+
         db = self.SessionLocal()
         try:
-            agent = db.query(Agent).filter(Agent.id == agent_id).first()
-            if agent and agent.security_policy_json:
-                return json.loads(agent.security_policy_json)
-            return {"hitl_enabled": False, "blocked_commands": [], "requires_approval_for": []} # Default
+            policy_json = db.scalar(
+                select(Agent.security_policy_json).where(Agent.id == agent_id).limit(1)
+            )
+        finally:
+            db.close()
+
+        policy = self._parse_policy(policy_json)
+        with self._policy_lock:
+            return self._cache_policy(agent_id, policy, now)
+
+    def get_agents_with_policies(self) -> List[Tuple[Any, dict]]:
+        """
+        All agents (id, hostname, status, platform) paired with their parsed policy,
+        read in one query. Also refreshes the policy cache for every agent returned.
+        """
+        db = self.SessionLocal()
+        try:
+            rows = db.execute(
+                select(Agent.id, Agent.hostname, Agent.status, Agent.platform, Agent.security_policy_json)
+            ).all()
         finally:
             db.close()
+
+        now = time.monotonic()
+        result = [(row, self._parse_policy(row.security_policy_json)) for row in rows]
+        with self._policy_lock:
+            for row, policy in result:
+                self._cache_policy(row.id, policy, now)
+        return result
+
+    @staticmethod
+    def _parse_policy(policy_json: Optional[str]) -> dict:
+        if policy_json:
+            return json.loads(policy_json)
+        return {"hitl_enabled": False, "blocked_commands": [], "requires_approval_for": []} # Default
+
+    @staticmethod
+    def _normalize_policy(policy: dict) -> dict:
+        # Lists are normalized when written; this also covers policies saved before that
+        return {
+            "hitl_enabled": bool(policy.get('hitl_enabled', False)),
+            "requires_approval": frozenset(x.strip().lower() for x in policy.get('requires_approval_for', []) if x.strip()),
+            "blocked_commands": frozenset(x.strip().lower() for x in policy.get('blocked_commands', []) if x.strip()),
+        }
+
+    def _cache_policy(self, agent_id: str, policy: dict, now: float) -> Tuple[dict, dict]:
+        """Store a policy and its normalized form in the TTL cache; caller holds _policy_lock."""
+        entry = (policy, self._normalize_policy(policy))
+        self._policy_cache[agent_id] = (now + POLICY_CACHE_TTL, entry)
+        if len(self._policy_cache) > POLICY_CACHE_SIZE:
+            self._policy_cache.pop(next(iter(self._policy_cache)))
+        return entry
             
     def db_cleanup_old_logs(self, days: int = 30):
         db = self.get_db()
@@ -226,25 +409,119 @@ class DataManager:
         finally:
             db.close()
 
-    def get_chat_messages(self, session_id: str):
+    def get_chat_session_summaries(self, limit: int = 50) -> List[Any]:
+        """Newest sessions as plain (id, title, has_unread) rows, for the session list."""
+        stmt = (
+            select(ChatSession.id, ChatSession.title, ChatSession.has_unread)
+            .order_by(ChatSession.created_at.desc())
+            .limit(limit)
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    def get_chat_messages(self, session_id: str, limit: Optional[int] = None, before: Optional[datetime] = None):
+        """
+        Messages of a session in chronological order. With `limit`, only the newest
+        `limit` messages (older than `before`, if given) are returned.
+        """
+        db = self.get_db()
+        try:
+            query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+            if before is not None:
+                query = query.filter(ChatMessage.timestamp < before)
+            if limit is None:
+                return query.order_by(ChatMessage.timestamp.asc()).all()
+            return query.order_by(ChatMessage.timestamp.desc()).limit(limit).all()[::-1]
+        finally:
+            db.close()
+
+    def get_chat_char_count(self, session_id: str) -> int:
+        """Total content length of a session's messages, summed in the database."""
         db = self.get_db()
         try:
-            return db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp.asc()).all()
+            return db.scalar(
+                select(func.coalesce(func.sum(func.length(ChatMessage.content)), 0))
+                .where(ChatMessage.session_id == session_id)
+            )
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Buffer save_chat_message / mark_session_unread calls made by the current task
+        and write them in a single commit when the block exits.
+        """
+        buffer = {"messages": [], "unread": set()}
+        token = _chat_write_buffer.set(buffer)
+        try:
+            yield
+        finally:
+            _chat_write_buffer.reset(token)
+            self._flush_chat_writes(buffer)
+
+    def _flush_chat_writes(self, buffer: dict):
+        if not buffer["messages"] and not buffer["unread"]:
+            return
+        db = self.SessionLocal()
+        try:
+            db.bulk_save_objects(buffer["messages"])
+            if buffer["unread"]:
+                db.query(ChatSession).filter(ChatSession.id.in_(buffer["unread"])).update(
+                    {ChatSession.has_unread: True}, synchronize_session=False
+                )
+            db.commit()
+        except Exception as e:
+            logger.error(f"Failed to flush buffered chat writes: {e}")
+            db.rollback()
         finally:
             db.close()
 
     def save_chat_message(self, session_id: str, role: str, content: str, metadata: dict = None):
+        message = ChatMessage(
+            session_id=session_id,
+            role=role,
+            content=content,
+            metadata_json=metadata
+        )
+        buffer = _chat_write_buffer.get()
+        if buffer is not None:
+            # Stamp now so buffered messages keep their order once flushed together
+            message.timestamp = datetime.utcnow()
+            buffer["messages"].append(message)
+            return message
+
         db = self.get_db()
         try:
-            message = ChatMessage(
+            db.add(message)
+            db.commit()
+            return message
+        finally:
+            db.close()
+
+    def save_chat_messages_bulk(self, session_id: str, items: List[Tuple[str, str, Optional[dict]]]):
+        """Write several (role, content, metadata) messages with a single commit."""
+        if not items:
+            return
+        now = datetime.utcnow()
+        # Microsecond offsets keep the batch in order when sorted by timestamp
+        messages = [
+            ChatMessage(
                 session_id=session_id,
                 role=role,
                 content=content,
-                metadata_json=metadata
+                metadata_json=metadata,
+                timestamp=now + timedelta(microseconds=i)
             )
-            db.add(message)
+            for i, (role, content, metadata) in enumerate(items)
+        ]
+        db = self.SessionLocal()
+        try:
+            db.bulk_save_objects(messages)
             db.commit()
-            return message
+        except Exception:
+            db.rollback()
+            raise
         finally:
             db.close()
 
@@ -260,6 +537,11 @@ class DataManager:
 
     def mark_session_unread(self, session_id: str):
         """Mark a chat session as having unread AI responses."""
+        buffer = _chat_write_buffer.get()
+        if buffer is not None:
+            buffer["unread"].add(session_id)
+            return
+
         db = self.SessionLocal()
         try:
             session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
@@ -0,0 +1,16 @@
+# server/app/services/errors.py
+"""
+Typed errors raised by the service layer.
+"""
+
+from typing import Any, Dict, Optional
+
+
+class ApprovalRequiredError(Exception):
+    """Raised by send_command when the agent pauses an action for HITL approval."""
+
+    def __init__(self, execution_id: Optional[str], payload: Optional[Dict[str, Any]] = None,
+                 message: str = "Action requires human approval"):
+        super().__init__(message)
+        self.execution_id = execution_id
+        self.payload = payload or {}
@@ -6,9 +6,14 @@ Provides tool calling support for the AI agent system.
 
 import os
 import logging
+import copy
+import hashlib
 import json
+import time
 import httpx
-from typing import Optional, Dict, Any, List, AsyncGenerator
+import orjson
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, AsyncGenerator
 from pathlib import Path
 import asyncio
 
@@ -17,6 +22,69 @@ logger = logging.getLogger(__name__)
 # llama-server endpoint
 LLAMA_BASE_URL = os.getenv("LLAMA_BASE_URL", "http://llama:8080")
 
+# Max number of distinct system prompts kept in the prompt cache
+SYSTEM_PROMPT_CACHE_SIZE = 128
+
+# Max number of generate() responses kept for identical requests
+RESPONSE_CACHE_SIZE = 512
+
+# Seconds a cached response stays valid; tool results and agent state go stale quickly
+RESPONSE_CACHE_TTL = 300
+
+
+def _tool_call_start(content: str) -> Optional[int]:
+    """Index where a text-based tool call begins in streamed content, or None."""
+    idx = content.find("```tool_call")
+    if idx >= 0:
+        return idx
+    stripped = content.lstrip()
+    if stripped.startswith(("{", "```json")) or "```tool_call".startswith(stripped):
+        # Also covers a still-incomplete opening fence such as "``"
+        return len(content) - len(stripped)
+    return None
+
+
+def _fenced_tool_calls(content: str, quiet: bool = False) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Every complete ```tool_call block in content, in order, plus the index just past the
+    last closing fence (0 if there is none). Blocks that aren't valid JSON are skipped;
+    `quiet` suppresses the warning for them while input is still streaming in.
+    """
+    calls = []
+    end = 0
+    idx = content.find("```tool_call")
+    while idx >= 0:
+        start = idx + len("```tool_call")
+        close = content.find("```", start)
+        if close < 0:
+            break
+        end = close + 3
+        try:
+            call = json.loads(content[start:close])
+            if isinstance(call, dict) and "tool" in call:
+                calls.append(call)
+        except json.JSONDecodeError:
+            if not quiet:
+                logger.warning(f"Skipping malformed tool call block: {content[start:close].strip()[:200]}")
+        idx = content.find("```tool_call", end)
+    return calls, end
+
+
+def _to_wire_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten a structured history entry into the text-only chat format llama-server expects.
+    Agent loops keep tool calls ({"role": "assistant", "tool_call": ...}) and results
+    ({"role": "tool", "content": {...}}) as dicts; they are encoded only here, at send time.
+    """
+    if "tool_call" in message:
+        return {"role": "assistant", "content": orjson.dumps(message["tool_call"]).decode()}
+    if message["role"] == "tool":
+        content = message["content"]
+        if not isinstance(content, str):
+            content = orjson.dumps(content).decode()
+        return {"role": "system", "content": f"Observation: {content}"}
+    return message
+
 
 class LLMService:
     """Service for running local GGUF models via llama-server API."""
@@ -27,6 +95,13 @@ class LLMService:
         self.is_loading: bool = False
         self.context_size: int = 4096
         self.client = httpx.AsyncClient(base_url=LLAMA_BASE_URL, timeout=None)
+        # (system prompt, tool names) -> full system message content
+        self._sysprompt_cache: OrderedDict = OrderedDict()
+        # request hash -> generate() result, for replaying identical requests
+        self._response_cache: OrderedDict = OrderedDict()
+        self._tool_sig: Optional[tuple] = None  # (tools object, schema hash)
+        # prefix handle -> prebuilt system message (system prompt + tool prompt)
+        self._prefixes: OrderedDict = OrderedDict()
         
     @property
     def model(self) -> Optional[str]:
@@ -77,32 +152,85 @@ class LLMService:
     
     async def generate(
         self,
-        messages: List[Dict[str, str]],
+        messages: List[Dict[str, Any]],
         tools: Optional[List[Dict]] = None,
         max_tokens: int = 1024,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        cache: bool = False,
+        prefix: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Async generation with optional tool calling."""
+        """
+        Async generation with optional tool calling.
+        With `cache` set, identical greedy requests (temperature 0, same messages, tools,
+        max_tokens and model) are answered from an in-memory cache for RESPONSE_CACHE_TTL
+        seconds. `prefix` is a handle from get_prefix_handle() whose prebuilt system message
+        replaces messages[0].
+        """
+        cache_key = self._response_cache_key(messages, tools, max_tokens, temperature) if cache and temperature == 0 else None
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+        result = await self._generate(messages, tools, max_tokens, temperature, prefix)
+        if cache_key is not None:
+            self._cache_put(cache_key, result)
+        return result
+
+    def _cache_get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Copy of a live cached response, or None; expired entries are dropped."""
+        entry = self._response_cache.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, cached = entry
+        if expires_at < time.monotonic():
+            del self._response_cache[cache_key]
+            return None
+        self._response_cache.move_to_end(cache_key)
+        logger.info(f"LLM cache hit, tokens saved={cached['usage'].get('total_tokens', 0)}")
+        return copy.deepcopy(cached)
+
+    def _cache_put(self, cache_key: str, result: Dict[str, Any]):
+        self._response_cache[cache_key] = (time.monotonic() + RESPONSE_CACHE_TTL, copy.deepcopy(result))
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+
+    def _response_cache_key(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict]], max_tokens: int, temperature: float) -> Optional[str]:
+        """Stable hash of everything that determines a generate() response."""
+        if tools is None:
+            tool_sig = None
+        elif self._tool_sig is not None and self._tool_sig[0] is tools:
+            tool_sig = self._tool_sig[1]
+        else:
+            tool_sig = hashlib.blake2b(orjson.dumps(tools, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+            self._tool_sig = (tools, tool_sig)
         try:
-            # Build the system prompt with tool definitions if provided
-            if tools:
-                tool_prompt = self._build_tool_prompt(tools)
-                if messages and messages[0]["role"] == "system":
-                    messages[0]["content"] += f"\n\n{tool_prompt}"
-                else:
-                    messages.insert(0, {"role": "system", "content": tool_prompt})
-            
-            # Map messages to llama-server format if needed, but llama-server supports OpenAI-like chat completions
-            payload = {
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "stream": False
-            }
+            blob = orjson.dumps(
+                {"m": messages, "t": tool_sig, "T": temperature, "mt": max_tokens, "model": self.model_name},
+                option=orjson.OPT_SORT_KEYS
+            )
+        except TypeError:
+            return None  # Not serializable; don't cache
+        return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+    async def _generate(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict]],
+        max_tokens: int,
+        temperature: float,
+        prefix: Optional[str] = None
+    ) -> Dict[str, Any]:
+        try:
+            payload = self._build_payload(messages, tools, max_tokens, temperature, stream=False, prefix=prefix)
             
-            response = await self.client.post("/v1/chat/completions", json=payload)
+            response = await self.client.post(
+                "/v1/chat/completions",
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"}
+            )
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             choice = data["choices"][0]
             message = choice["message"]
@@ -111,32 +239,38 @@ class LLMService:
             
             # Extract Usage
             usage = data.get("usage", {"total_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            # llama-server reports how much of the prompt was served from its KV cache
+            usage["cached_tokens"] = data.get("timings", {}).get("cache_n", 0)
             
             result = {
                 "content": content,
                 "tool_call": None,
-                "usage": usage
+                "tool_calls": [],
+                "usage": usage,
+                "response_id": data.get("id")
             }
 
-            # Parse Tool Call (simplify to single tool for ReAct loop)
+            # Parse Tool Calls; "tool_call" keeps the first one for the single-tool ReAct loop
             if tool_calls:
-                tc = tool_calls[0]
-                func = tc["function"]
-                try:
-                    args = json.loads(func["arguments"])
-                    result["tool_call"] = {
-                        "tool": func["name"],
-                        "params": args
-                    }
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to parse tool arguments: {func['arguments']}")
+                for tc in tool_calls:
+                    func = tc["function"]
+                    try:
+                        args = json.loads(func["arguments"])
+                        result["tool_calls"].append({
+                            "tool": func["name"],
+                            "params": args
+                        })
+                    except json.JSONDecodeError:
+                        logger.error(f"Failed to parse tool arguments: {func['arguments']}")
+                if result["tool_calls"]:
+                    result["tool_call"] = result["tool_calls"][0]
             
             # 2. Fallback: Parse Content for Text-based Tool Call
             # This is the missing piece causing your issue
             elif content:
-                parsed_tool = self._parse_tool_call(content)
-                if parsed_tool:
-                    result["tool_call"] = parsed_tool
+                result["tool_calls"] = self._parse_tool_calls(content)
+                if result["tool_calls"]:
+                    result["tool_call"] = result["tool_calls"][0]
                     # Optional: Clean up content so the user doesn't see the raw JSON
                     # result["content"] = ""
             
@@ -180,6 +314,174 @@ class LLMService:
             logger.error(f"Streaming failed: {e}")
             raise
 
+    async def stream(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict]] = None,
+        max_tokens: int = 1024,
+        temperature: float = 0.7,
+        cache: bool = False,
+        prefix: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Streaming counterpart of generate() for the agent loop.
+        Yields {"delta": text} for user-visible text as it arrives, then one final
+        {"result": ...} shaped like generate()'s return value. Text-based tool calls are
+        never yielded as deltas. The stream is cut as soon as a bare JSON call is complete,
+        or when text other than another ```tool_call block follows the fenced calls.
+        """
+        cache_key = self._response_cache_key(messages, tools, max_tokens, temperature) if cache and temperature == 0 else None
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                if not cached["tool_call"] and cached["content"]:
+                    yield {"delta": cached["content"]}
+                yield {"result": cached}
+                return
+
+        payload = self._build_payload(messages, tools, max_tokens, temperature, stream=True, prefix=prefix)
+        payload["stream_options"] = {"include_usage": True}
+
+        content = ""
+        shown = 0  # Characters of content already yielded as deltas
+        tool_calls = []
+        usage = {"total_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        response_id = None
+        try:
+            async with self.client.stream(
+                "POST", "/v1/chat/completions",
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"}
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data_str = line[6:].strip()
+                    if data_str == "[DONE]":
+                        break
+                    try:
+                        data = orjson.loads(data_str)
+                    except orjson.JSONDecodeError:
+                        continue
+
+                    response_id = data.get("id", response_id)
+                    if data.get("usage"):
+                        usage = data["usage"]
+                        usage["cached_tokens"] = data.get("timings", {}).get("cache_n", 0)
+                    choices = data.get("choices") or [{}]
+                    piece = choices[0].get("delta", {}).get("content")
+                    if not piece:
+                        continue
+                    content += piece
+
+                    # Hold back anything that may be (the start of) a tool call
+                    tool_start = _tool_call_start(content)
+                    if tool_start is None:
+                        if len(content) > shown:
+                            yield {"delta": content[shown:]}
+                            shown = len(content)
+                        continue
+                    if tool_start > shown:
+                        yield {"delta": content[shown:tool_start]}
+                        shown = tool_start
+                    if "```tool_call".startswith(content[tool_start:tool_start + 12]):
+                        calls, end = _fenced_tool_calls(content, quiet=True)
+                        rest = content[end:].lstrip()
+                        if calls and rest and not (rest.startswith("```tool_call") or "```tool_call".startswith(rest)):
+                            break  # Anything but another call after the calls; stop generating
+                    elif "}" in piece:
+                        tool_call = self._parse_tool_call(content[tool_start:], quiet=True)
+                        if tool_call:
+                            tool_calls = [tool_call]
+                            break  # Complete call read; stop generating
+
+        except Exception as e:
+            logger.error(f"Streaming failed: {e}")
+            raise
+
+        if not tool_calls and _tool_call_start(content) is not None:
+            tool_calls = self._parse_tool_calls(content)
+        result = {
+            "content": content,
+            "tool_call": tool_calls[0] if tool_calls else None,
+            "tool_calls": tool_calls,
+            "usage": usage,
+            "response_id": response_id
+        }
+        if cache_key is not None:
+            self._cache_put(cache_key, result)
+        yield {"result": result}
+
+    def _build_payload(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict]],
+        max_tokens: int,
+        temperature: float,
+        stream: bool,
+        prefix: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Build the /v1/chat/completions request body."""
+        # Build the system prompt with tool definitions if provided.
+        # Work on a copy so repeated turns don't keep appending the tool prompt.
+        system_message = self._prefixes.get(prefix) if prefix is not None else None
+        if system_message is not None:
+            if messages and messages[0]["role"] == "system":
+                messages = list(messages)[1:]
+            messages = [system_message] + messages
+        elif tools:
+            if messages and messages[0]["role"] == "system":
+                system_content = self._get_system_content(messages[0]["content"], tools)
+                messages = [{"role": "system", "content": system_content}] + list(messages)[1:]
+            else:
+                system_content = self._get_system_content(None, tools)
+                messages = [{"role": "system", "content": system_content}] + list(messages)
+        
+        # Map messages to llama-server format if needed, but llama-server supports OpenAI-like chat completions
+        return {
+            "messages": [_to_wire_message(m) for m in messages],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": stream,
+            # Reuse the KV cache for the unchanged prefix (system prompt + history)
+            "cache_prompt": True
+        }
+
+    def get_prefix_handle(self, system_prompt: Optional[str], tools: Optional[List[Dict]]) -> str:
+        """
+        Build the system message for a prompt + tool set once and return a stable handle.
+        Passing the handle as `prefix` on every turn sends a byte-identical prefix without
+        rebuilding it, so llama-server's prompt cache can skip re-evaluating those tokens.
+        """
+        content = self._get_system_content(system_prompt, tools) if tools else (system_prompt or "")
+        handle = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        if handle in self._prefixes:
+            self._prefixes.move_to_end(handle)
+        else:
+            self._prefixes[handle] = {"role": "system", "content": content}
+            if len(self._prefixes) > SYSTEM_PROMPT_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+        return handle
+
+    def _get_system_content(self, system_prompt: Optional[str], tools: List[Dict]) -> str:
+        """
+        Return the system message with the tool prompt appended, memoized per prompt.
+        Keeping this byte-identical across turns lets llama-server reuse its prompt cache.
+        """
+        key = (system_prompt, tuple(t['name'] for t in tools))
+        content = self._sysprompt_cache.get(key)
+        if content is not None:
+            self._sysprompt_cache.move_to_end(key)
+            return content
+
+        tool_prompt = self._build_tool_prompt(tools)
+        content = f"{system_prompt}\n\n{tool_prompt}" if system_prompt is not None else tool_prompt
+        self._sysprompt_cache[key] = content
+        if len(self._sysprompt_cache) > SYSTEM_PROMPT_CACHE_SIZE:
+            self._sysprompt_cache.popitem(last=False)
+        return content
+
     def _build_tool_prompt(self, tools: List[Dict]) -> str:
         """Build a strict tool description prompt with examples."""
         tool_descriptions = []
@@ -201,6 +503,7 @@ If a user request requires a tool, you MUST execute it immediately.
 2. Verify your results. If a tool fails (e.g. "command not found"), TRY A DIFFERENT WAY immediately.
 3. Do not assume. Use `list_agents` to get IDs before running commands.
 4. Only use the tools listed above. Do not make up tools like "getstorageinfo".
+5. Independent calls may be sent together, one ```tool_call block each; they run in parallel.
 
 ### AVAILABLE TOOLS
 {chr(10).join(tool_descriptions)}
@@ -227,10 +530,27 @@ User: "Run df -h on agent-main"
 Assistant:
 ```tool_call
 {{"tool": "run_command", "params": {{"agent_id": "agent-main", "command": "df -h"}}}}
+```
+
+User: "Show uptime and the kernel version on agent-main"
+Assistant:
+```tool_call
+{{"tool": "run_command", "params": {{"agent_id": "agent-main", "command": "uptime"}}}}
+```
+```tool_call
+{{"tool": "run_command", "params": {{"agent_id": "agent-main", "command": "uname -r"}}}}
 ```"""
     
-    def _parse_tool_call(self, content: str) -> Optional[Dict[str, Any]]:
-        """Robustly parse tool calls from mixed text."""
+    def _parse_tool_calls(self, content: str) -> List[Dict[str, Any]]:
+        """All tool calls in a reply: every ```tool_call block, else the single call _parse_tool_call finds."""
+        calls, _ = _fenced_tool_calls(content)
+        if calls:
+            return calls
+        call = self._parse_tool_call(content)
+        return [call] if call else []
+
+    def _parse_tool_call(self, content: str, quiet: bool = False) -> Optional[Dict[str, Any]]:
+        """Robustly parse tool calls from mixed text. `quiet` suppresses parse warnings for partial input."""
         try:
             # 1. Try standard markdown block
             if "```tool_call" in content:
@@ -255,7 +575,8 @@ Assistant:
                 return json.loads(content)
 
         except Exception as e:
-            logger.warning(f"Failed to parse tool call: {e}")
+            if not quiet:
+                logger.warning(f"Failed to parse tool call: {e}")
         
         return None
 
@@ -8,30 +8,93 @@ Uses huggingface_hub to download GGUF files.
 import os
 import logging
 import math
+import shlex
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable
 import docker
+import importlib.util
+
+# Parallel download backends. huggingface_hub reads these at import time, so they
+# must be set before it is imported. Explicit user settings take precedence.
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+os.environ.setdefault("HF_XET_NUM_CONCURRENT_RANGE_GETS", "16")
+
 from huggingface_hub import hf_hub_download, list_repo_files, HfApi
 import asyncio
+import struct
+import time
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
-# Try to import GGUF, handle if missing
-try:
-    import gguf
-except ImportError:
-    gguf = None
-
 logger = logging.getLogger(__name__)
 
+if os.environ.get("HF_HUB_ENABLE_HF_TRANSFER") != "1":
+    logger.info("hf_transfer is not enabled; downloads of non-Xet repos will use a single connection")
+
 # Default model storage path
 MODELS_DIR = Path(os.getenv("MODELS_PATH", "/server/llm_models"))
 
+# fsync the llama args file and its directory after each write
+STRICT_FSYNC = os.getenv("FABRICORE_STRICT_FSYNC") == "1"
+
+# GGUF metadata layout (https://github.com/ggml-org/ggml/blob/master/docs/gguf.md)
+GGUF_MAGIC = 0x46554747  # b"GGUF" little-endian
+GGUF_TYPE_STRING = 8
+GGUF_TYPE_ARRAY = 9
+_GGUF_HEADER = struct.Struct('<IIQQ')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_GGUF_SCALARS = {
+    0: struct.Struct('<B'), 1: struct.Struct('<b'),
+    2: struct.Struct('<H'), 3: struct.Struct('<h'),
+    4: struct.Struct('<I'), 5: struct.Struct('<i'),
+    6: struct.Struct('<f'), 7: struct.Struct('<?'),
+    10: struct.Struct('<Q'), 11: struct.Struct('<q'),
+    12: struct.Struct('<d'),
+}
+
+
+def _gguf_read_str(f) -> str:
+    (length,) = _U64.unpack(f.read(8))
+    return f.read(length).decode('utf-8', errors='replace')
+
+
+def _gguf_skip_value(f, value_type: int):
+    """Advance past a GGUF metadata value without materializing it."""
+    if value_type in _GGUF_SCALARS:
+        f.seek(_GGUF_SCALARS[value_type].size, 1)
+    elif value_type == GGUF_TYPE_STRING:
+        (length,) = _U64.unpack(f.read(8))
+        f.seek(length, 1)
+    elif value_type == GGUF_TYPE_ARRAY:
+        (elem_type,) = _U32.unpack(f.read(4))
+        (count,) = _U64.unpack(f.read(8))
+        if elem_type in _GGUF_SCALARS:
+            f.seek(_GGUF_SCALARS[elem_type].size * count, 1)
+        else:
+            for _ in range(count):
+                _gguf_skip_value(f, elem_type)
+    else:
+        raise ValueError(f"Unknown GGUF value type {value_type}")
+
+
 # Thread pool for background downloads
 executor = ThreadPoolExecutor(max_workers=2)
 
 # Track download progress
 download_status: Dict[str, Dict[str, Any]] = {}
 
+# Hugging Face search / file-listing results are reused for this long (seconds)
+HF_CACHE_TTL = 600.0
+HF_CACHE_SIZE = 128
+
+# How often a running download's partial file is sized for progress reports (seconds)
+DOWNLOAD_POLL_INTERVAL = 0.5
+
+# The local model listing (a directory glob + stat per file) is reused for this long (seconds)
+LOCAL_MODELS_TTL = 5.0
+
 
 class ModelManager:
     def __init__(self, models_dir: Path = MODELS_DIR, hf_token: Optional[str] = None):
@@ -43,6 +106,26 @@ class ModelManager:
         except Exception as e:
             logger.error(f"Failed to initialize Docker client: {e}")
             self.docker_client = None
+
+        # Single-flight guard for load_model: concurrent requests for the same
+        # configuration share one container restart instead of issuing several.
+        self._load_lock = asyncio.Lock()
+        self._inflight: Optional[Tuple[tuple, asyncio.Future]] = None
+        # Load key of the model currently running in llama-server; set only after a load succeeds
+        self._loaded_key: Optional[tuple] = None
+
+        # (kind, key) -> (expires_at, result) for Hugging Face API lookups, plus the
+        # lookups currently in flight so concurrent identical requests share one call
+        self._hf_cache: OrderedDict = OrderedDict()
+        self._hf_pending: Dict[tuple, asyncio.Future] = {}
+        # (expires_at, models) from the last get_local_models() scan; dropped on download/delete
+        self._local_models: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+
+        # Command line written to llama_args.txt on each load
+        self._args_template = (
+            "--model {model} --host 0.0.0.0 --port 8080 --n-gpu-layers {ngl} "
+            "--ctx-size {ctx} --parallel {par} --flash-attn on"
+        )
         
         # Ensure models directory exists
         self.models_dir.mkdir(parents=True, exist_ok=True)
@@ -56,38 +139,73 @@ class ModelManager:
             except Exception as e:
                 logger.warning(f"Failed to clear startup config: {e}")
 
-        # Aggressively reset llama container to ensure clean startup state
+        # Stop any llama container left running from a previous session. The args file
+        # is already cleared, so there is nothing to restart into; do it off-thread so
+        # server startup doesn't wait on Docker.
         if self.docker_client:
-            try:
-                containers = self.docker_client.containers.list(all=True, filters={"label": "com.docker.compose.service=llama"})
-                if containers:
-                    container = containers[0]
-                    if container.status == 'running':
-                        logger.info("♻️  Resetting Llama container to ensure clean startup state...")
-                        container.restart()
-                        logger.info("Llama container reset successful.")
-            except Exception as e:
-                logger.error(f"Failed to reset llama container on startup: {e}")
+            executor.submit(self._stop_stale_llama_container)
 
         logger.info(f"ModelManager initialized. Models directory: {self.models_dir}")
 
+    def _stop_stale_llama_container(self):
+        """Stop the llama container if it is still serving a previously loaded model."""
+        try:
+            containers = self.docker_client.containers.list(all=True, filters={"label": "com.docker.compose.service=llama"})
+            if containers:
+                container = containers[0]
+                if container.attrs.get('State', {}).get('Running'):
+                    logger.info("Stopping stale llama container to ensure clean startup state...")
+                    container.stop(timeout=0)
+                    logger.info("Llama container stopped.")
+        except Exception as e:
+            logger.error(f"Failed to reset llama container on startup: {e}")
+
     def set_token(self, token: str):
         """Update Hugging Face token."""
         self.hf_token = token
         self.api = HfApi(token=token)
+        self._hf_cache.clear()  # Visibility of private/gated repos may differ per token
         logger.info("Hugging Face token updated.")
 
+    async def _hf_cached(self, key: tuple, fetch) -> Any:
+        """Return a cached Hugging Face lookup, or run `fetch()` once for all concurrent callers."""
+        entry = self._hf_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._hf_cache.move_to_end(key)
+            return entry[1]
+
+        pending = self._hf_pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(fetch())
+            self._hf_pending[key] = pending
+            pending.add_done_callback(lambda _: self._hf_pending.pop(key, None))
+        result = await asyncio.shield(pending)
+
+        # Failed lookups come back empty; don't pin those for the whole TTL
+        if result:
+            self._hf_cache[key] = (time.monotonic() + HF_CACHE_TTL, result)
+            self._hf_cache.move_to_end(key)
+            if len(self._hf_cache) > HF_CACHE_SIZE:
+                self._hf_cache.popitem(last=False)
+        return result
+
     def get_local_models(self) -> List[Dict[str, Any]]:
-        """Get list of locally installed models."""
+        """Get list of locally installed models (rescanned at most every LOCAL_MODELS_TTL seconds)."""
+        if self._local_models and self._local_models[0] > time.monotonic():
+            return list(self._local_models[1])
         models = []
         if self.models_dir.exists():
-            for file in self.models_dir.glob("*.gguf"):
-                models.append({
-                    "name": file.name,
-                    "path": str(file),
-                    "size": f"{file.stat().st_size / (1024**3):.2f} GB"
-                })
-        return models
+            # One directory read; DirEntry carries the type, so only .gguf files are stat'ed
+            with os.scandir(self.models_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".gguf") and entry.is_file():
+                        models.append({
+                            "name": entry.name,
+                            "path": entry.path,
+                            "size": f"{entry.stat().st_size / (1024**3):.2f} GB"
+                        })
+        self._local_models = (time.monotonic() + LOCAL_MODELS_TTL, models)
+        return list(models)
 
     def is_model_installed(self, repo_id: str, filename: str) -> bool:
         """Check if a model file is already downloaded."""
@@ -114,6 +232,7 @@ class ModelManager:
             )
             
             download_status[repo_id] = {'status': 'completed', 'progress': 100, 'filename': filename, 'path': local_path}
+            self._local_models = None
             logger.info(f"Download completed: {local_path}")
             return local_path
             
@@ -122,16 +241,66 @@ class ModelManager:
             download_status[repo_id] = {'status': 'failed', 'progress': 0, 'error': str(e)}
             raise
 
-    async def download_model(self, repo_id: str, filename: str) -> str:
-        """Async wrapper for model download."""
+    def _remote_file_size(self, repo_id: str, filename: str) -> Optional[int]:
+        """Size in bytes of a file on the Hub, or None if it can't be determined."""
+        try:
+            info = self.api.get_paths_info(repo_id, [filename])
+            return info[0].size if info else None
+        except Exception as e:
+            logger.debug(f"Could not get size of {repo_id}/{filename}: {e}")
+            return None
+
+    def _partial_download_size(self, filename: str) -> int:
+        """
+        Bytes written so far for `filename`. huggingface_hub downloads into
+        <local_dir>/.cache/huggingface/download/<subdir>/<hash>.<etag>.incomplete;
+        the most recently written one in that folder is taken to be ours.
+        """
+        download_dir = self.models_dir / ".cache" / "huggingface" / "download" / Path(filename).parent
+        latest = (0.0, 0)
+        try:
+            for part in download_dir.glob("*.incomplete"):
+                st = part.stat()
+                latest = max(latest, (st.st_mtime, st.st_size))
+        except OSError:
+            pass  # Partial file renamed into place or removed mid-scan
+        return latest[1]
+
+    async def download_model(self, repo_id: str, filename: str,
+                             progress_cb: Optional[Callable[[int, Optional[int]], None]] = None) -> str:
+        """
+        Async wrapper for model download.
+        If given, progress_cb(bytes_done, bytes_total) is called every DOWNLOAD_POLL_INTERVAL
+        seconds while it runs; bytes_total is None if the Hub didn't report a size.
+        """
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(executor, self.download_model_sync, repo_id, filename)
+        download = loop.run_in_executor(executor, self.download_model_sync, repo_id, filename)
+        if progress_cb is None:
+            return await download
+
+        total = await loop.run_in_executor(None, self._remote_file_size, repo_id, filename)
+        while not download.done():
+            await asyncio.wait({download}, timeout=DOWNLOAD_POLL_INTERVAL)
+            if download.done():
+                break
+            done = self._partial_download_size(filename)
+            if total and repo_id in download_status:
+                download_status[repo_id]['progress'] = min(99, int(done * 100 / total))
+            progress_cb(done, total)
+        return await download
 
     async def search_hf_models(self, query: str = "", limit: int = 10) -> List[Dict[str, Any]]:
         """
         Search for GGUF models on Hugging Face.
-        Returns a list of model info dicts.
+        Returns a list of model info dicts, cached for HF_CACHE_TTL seconds per query.
         """
+        query = (query or "").strip()
+        return await self._hf_cached(
+            ("search", query.lower(), limit),
+            lambda: self._search_hf_models(query, limit)
+        )
+
+    async def _search_hf_models(self, query: str, limit: int) -> List[Dict[str, Any]]:
         loop = asyncio.get_event_loop()
         try:
             # Search for models with 'gguf' tag
@@ -163,7 +332,10 @@ class ModelManager:
             return []
 
     async def get_model_files(self, repo_id: str) -> List[str]:
-        """Get list of GGUF files in a repository."""
+        """Get list of GGUF files in a repository, cached for HF_CACHE_TTL seconds."""
+        return await self._hf_cached(("files", repo_id), lambda: self._get_model_files(repo_id))
+
+    async def _get_model_files(self, repo_id: str) -> List[str]:
         loop = asyncio.get_event_loop()
         try:
             def _list():
@@ -175,33 +347,96 @@ class ModelManager:
             return []
 
     def _get_model_layers(self, model_path: Path) -> int:
-        """Read the GGUF header to find the total number of layers."""
-        if not gguf:
-            logger.warning("GGUF library not found. Assuming metadata reading unavailable.")
-            return 0
-            
+        """
+        Read the GGUF header to find the total number of layers.
+        Walks the metadata key/value section with struct instead of building a
+        full GGUFReader, skipping large values (tokenizer arrays) with seek().
+        """
         try:
-            reader = gguf.GGUFReader(str(model_path), mode='r')
-            # 1. Get architecture (e.g., 'llama', 'qwen2')
-            field = reader.fields.get('general.architecture')
-            if not field:
-                return 0
-            
-            arch = bytes(field.parts[-1]).decode('utf-8')
-            
-            # 2. Get block count (e.g., 'llama.block_count')
-            block_count_field = reader.fields.get(f'{arch}.block_count')
-            if block_count_field:
-                return int(block_count_field.parts[-1][0])
-                
+            with open(model_path, 'rb') as f:
+                magic, version, _tensor_count, kv_count = _GGUF_HEADER.unpack(f.read(_GGUF_HEADER.size))
+                if magic != GGUF_MAGIC or version < 2:
+                    logger.warning(f"Unsupported GGUF header in {model_path} (version {version})")
+                    return 0
+
+                arch = None
+                for _ in range(kv_count):
+                    key = _gguf_read_str(f)
+                    (value_type,) = _U32.unpack(f.read(4))
+
+                    if key == 'general.architecture' and value_type == GGUF_TYPE_STRING:
+                        arch = _gguf_read_str(f)
+                    elif arch and key == f'{arch}.block_count' and value_type in _GGUF_SCALARS:
+                        fmt = _GGUF_SCALARS[value_type]
+                        return int(fmt.unpack(f.read(fmt.size))[0])
+                    else:
+                        _gguf_skip_value(f, value_type)
+
         except Exception as e:
             logger.error(f"Failed to read GGUF metadata for {model_path}: {e}")
-        
+
         return 0
+
+    def _write_args_file(self, args_file: Path, content: str):
+        """
+        Atomically replace the llama args file so the llama container never
+        observes a truncated or partially written command line.
+        """
+        tmp = args_file.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            f.write(content)
+            f.flush()
+            if STRICT_FSYNC:
+                os.fsync(f.fileno())
+        os.replace(tmp, args_file)
+
+        if STRICT_FSYNC:
+            # Persist the rename itself so a restart after an unclean shutdown sees the new file
+            dir_fd = os.open(args_file.parent, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    @property
+    def loaded_name(self) -> Optional[str]:
+        """Name of the model llama-server is serving, or None if none was loaded by us."""
+        return self._loaded_key[0] if self._loaded_key else None
+
     async def load_model(self, model_name: str, n_ctx: int = 4096, n_parallel: int = 1, kv_cache_type: str = "fp16", gpu_offload_percent: int = 100) -> bool:
         """
         Load a model by restarting the llama container with new parameters.
+        Duplicate requests for a load that is already in flight await its result.
         """
+        key = (model_name, n_ctx, n_parallel, kv_cache_type, gpu_offload_percent)
+        if key == self._loaded_key:
+            return True  # Already running with this configuration
+        if self._inflight and self._inflight[0] == key:
+            logger.info(f"Load of {model_name} already in progress, waiting for it...")
+            return await asyncio.shield(self._inflight[1])
+
+        async with self._load_lock:
+            # A load queued ahead of this one may have brought up the same configuration
+            if key == self._loaded_key:
+                return True
+            future = asyncio.get_event_loop().create_future()
+            self._inflight = (key, future)
+            try:
+                self._loaded_key = None  # The container is about to restart
+                result = await self._load_model(model_name, n_ctx, n_parallel, kv_cache_type, gpu_offload_percent)
+                if result:
+                    self._loaded_key = key
+                future.set_result(result)
+                return result
+            except BaseException as e:
+                future.set_exception(e)
+                future.exception()  # Mark retrieved so an unawaited future doesn't warn
+                raise
+            finally:
+                self._inflight = None
+
+    async def _load_model(self, model_name: str, n_ctx: int, n_parallel: int, kv_cache_type: str, gpu_offload_percent: int) -> bool:
+        """Restart the llama container with the given configuration. Callers must hold _load_lock."""
         if not self.docker_client:
             logger.error("Docker client not initialized. Cannot load model.")
             return False
@@ -236,26 +471,20 @@ class ModelManager:
             # server container path: /server/llm_models/llama_args.txt
             # llama container path: /app/llm_models/llama_args.txt
             
-            # Basic args
-            args_list = [
-                f"--model {container_model_path}",
-                "--host 0.0.0.0",
-                "--port 8080",
-                f"--n-gpu-layers {n_gpu_layers}",
-                f"--ctx-size {n_ctx}",
-                f"--parallel {n_parallel}",
-                "--flash-attn on"
-            ]
-            
-            # Removed the manual toggle logic here
+            # Basic args (model path is shell-quoted; start_llama.sh parses the file with shell rules)
+            args_content = self._args_template.format_map({
+                "model": shlex.quote(container_model_path),
+                "ngl": n_gpu_layers,
+                "ctx": n_ctx,
+                "par": n_parallel,
+            })
             
             if kv_cache_type and kv_cache_type != "fp16":
-                args_list.append(f"--cache-type-k {kv_cache_type}")
-                args_list.append(f"--cache-type-v {kv_cache_type}")
+                kv = shlex.quote(kv_cache_type)
+                args_content += f" --cache-type-k {kv} --cache-type-v {kv}"
 
-            args_content = " ".join(args_list)
             args_file = self.models_dir / "llama_args.txt"
-            args_file.write_text(args_content)
+            self._write_args_file(args_file, args_content)
             
             logger.info(f"Restarting llama container...")
             llama_container.restart()
@@ -301,6 +530,7 @@ class ModelManager:
         if model_path.exists():
             try:
                 model_path.unlink()
+                self._local_models = None
                 logger.info(f"Deleted model file: {filename}")
                 return True
             except Exception as e:
@@ -317,6 +547,8 @@ class ModelManager:
             return False
 
         try:
+            self._loaded_key = None
+
             # 1. Clear configuration
             args_file = self.models_dir / "llama_args.txt"
             if args_file.exists():
@@ -1,16 +1,47 @@
 # server/app/services/scheduler.py
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Optional
+import asyncio
 import logging
+import weakref
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import update
 from app.core.dependencies import get_db, get_agent_manager, get_model_manager, get_data_manager, get_llm_service
-from app.models.db import Schedule, Agent, AuditLog, PendingApproval
+from app.models.db import Schedule, Agent, AuditLog
 from app.services.tools import ToolExecutor, get_tool_definitions
 import uuid
-import json
+import orjson
 
 logger = logging.getLogger(__name__)
 
+SCHEDULED_SYSTEM_PROMPT = "You are executing a scheduled task: {task}. You are an autonomous agent."
+
+
+# Longest tool output kept in a scheduled job's LLM history; larger outputs are clipped
+MAX_OBSERVATION_CHARS = 16000
+
+
+def _clip_observation(result: dict) -> dict:
+    """Clip oversized 'output'/'content' strings so they aren't re-encoded on every turn."""
+    for key in ("output", "content"):
+        value = result.get(key)
+        if isinstance(value, str) and len(value) > MAX_OBSERVATION_CHARS:
+            result = {**result, key: f"{value[:MAX_OBSERVATION_CHARS]}\n... [truncated {len(value) - MAX_OBSERVATION_CHARS} chars]"}
+    return result
+
+
+@lru_cache(maxsize=256)
+def parse_cron(expression: str) -> CronTrigger:
+    """Parse a crontab expression, memoized per literal string. Raises ValueError if invalid."""
+    return CronTrigger.from_crontab(expression)
+
+
+def _dumps(obj) -> str:
+    """Serialize to a JSON string using orjson."""
+    return orjson.dumps(obj).decode()
+
 
 class SchedulerService:
     def __init__(self):
@@ -18,9 +49,14 @@ class SchedulerService:
         self.llm_service = get_llm_service()
         self.data_manager = get_data_manager()
         self.tool_executor = ToolExecutor(self.data_manager)
+        self._tool_defs = get_tool_definitions()
+        # schedule_id -> lock; an entry lives only while a run holds or awaits it
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
 
     def start(self):
-        """Start the scheduler and load existing jobs from DB."""
+        """Start the scheduler and load existing jobs from DB. Calling it again is a no-op."""
+        if self.scheduler.running:
+            return
         self.scheduler.start()
         self._load_existing_jobs()
         logger.info("Scheduler started.")
@@ -42,13 +78,31 @@ class SchedulerService:
             db.close()
 
     def add_job(self, schedule_id: str, cron_expression: str, task_instruction: str,
-                model_name: str, agent_id: str):
+                model_name: str, agent_id: str, trigger: Optional[CronTrigger] = None):
+        """
+        Register a schedule; `trigger` may be a CronTrigger already built by parse_cron().
+        Jobs only carry the schedule id (the rest is read from the DB per run), so an
+        existing job is left alone unless its cron expression changed.
+        """
+        trigger = trigger or parse_cron(cron_expression)
+        existing = self.scheduler.get_job(schedule_id)
+        if existing is not None:
+            # parse_cron() returns the same object for the same expression
+            if existing.trigger is not trigger:
+                existing.reschedule(trigger)
+                logger.info(f"Rescheduled job {schedule_id}: {cron_expression}")
+            return
+
         self.scheduler.add_job(
             self.run_scheduled_job,
-            CronTrigger.from_crontab(cron_expression),
+            trigger,
             id=schedule_id,
             args=[schedule_id],
-            replace_existing=True
+            replace_existing=True,
+            # Never overlap runs of one schedule; collapse missed fires into one
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=300
         )
         logger.info(f"Added job {schedule_id}: {task_instruction}")
 
@@ -70,21 +124,39 @@ class SchedulerService:
             pass
         return None
 
+    def get_next_run_times(self, schedule_ids) -> Dict[str, str]:
+        """Next run times (ISO format) for several jobs, read from one get_jobs() pass."""
+        wanted = set(schedule_ids)
+        try:
+            return {
+                job.id: job.next_run_time.isoformat()
+                for job in self.scheduler.get_jobs()
+                if job.id in wanted and job.next_run_time
+            }
+        except Exception:
+            return {}
+
     async def run_scheduled_job(self, schedule_id: str):
+        # Serialize runs of the same schedule, including ones triggered outside APScheduler
+        lock = self._locks.setdefault(schedule_id, asyncio.Lock())
+        async with lock:
+            await self._run_scheduled_job(schedule_id)
+
+    async def _run_scheduled_job(self, schedule_id: str):
         logger.info(f"Running scheduled job: {schedule_id}")
-        db = next(get_db())
-        job = db.query(Schedule).get(schedule_id)
+        # Only hold a DB session for the short reads/writes below, never across
+        # the LLM and tool awaits, so scheduled jobs don't pin pool connections.
+        async with self.data_manager.get_async_db() as s:
+            job = await s.get(Schedule, schedule_id)
 
         if not job or not job.is_active:
-            db.close()
             return
 
         try:
             # 1. Check/Switch Model (if needed)
             if job.required_model:
                 model_manager = get_model_manager()
-                current_model = self.llm_service.model_name
-                if current_model != job.required_model:
+                if model_manager.loaded_name != job.required_model:
                     logger.info(f"Switching model to {job.required_model} for scheduled task...")
                     await model_manager.load_model(job.required_model)
 
@@ -99,81 +171,122 @@ class SchedulerService:
                 session_id = session.id
                 if job.use_persistent_chat:
                     # Save this session ID for future runs
-                    job.chat_session_id = session_id
-                    db.commit()
-
-            # 3. Run Agent Loop
-            system_prompt = f"You are executing a scheduled task: {job.task_instruction}. You are an autonomous agent."
-            messages = [{"role": "system", "content": system_prompt}]
-
-            # Save initial user-like message to chat
-            self.data_manager.save_chat_message(
-                session_id, 'user',
-                f"🤖 **Scheduled Task**: {job.task_instruction}",
-                metadata={"type": "scheduled_trigger", "schedule_id": schedule_id}
-            )
-
-            final_content = ""
-            for turn in range(5):
-                response = await self.llm_service.generate(
-                    messages=messages,
-                    tools=get_tool_definitions(),
-                    max_tokens=1024
+                    async with self.data_manager.get_async_db() as s, s.begin():
+                        await s.execute(
+                            update(Schedule).where(Schedule.id == schedule_id).values(chat_session_id=session_id)
+                        )
+
+            # 3. Run Agent Loop (chat writes are committed together when the job ends,
+            # and one session is shared by every tool call in the job)
+            with self.data_manager.transaction(), self.data_manager.SessionLocal() as tool_db:
+                system_prompt = SCHEDULED_SYSTEM_PROMPT.format(task=job.task_instruction)
+                messages = [{"role": "system", "content": system_prompt}]
+
+                # Save initial user-like message to chat
+                self.data_manager.save_chat_message(
+                    session_id, 'user',
+                    f"🤖 **Scheduled Task**: {job.task_instruction}",
+                    metadata={"type": "scheduled_trigger", "schedule_id": schedule_id}
                 )
 
-                tool_call = response.get("tool_call")
-                content = response["content"]
-
-                if not tool_call:
-                    final_content = content
-                    logger.info(f"Job {schedule_id} finished: {content}")
-                    break
-
-                # Execute Tool
-                tool_name = tool_call["tool"]
-                tool_args = tool_call.get("params", {})
-
-                if "agent_id" not in tool_args and job.agent_id:
-                    tool_args["agent_id"] = job.agent_id
-
-                tool_result = await self.tool_executor.execute(tool_name, tool_args)
-
-                messages.append({"role": "assistant", "content": json.dumps(tool_call)})
-                messages.append({"role": "system", "content": f"Observation: {json.dumps(tool_result)}"})
-
-                # Check for HITL pause
-                if tool_result.get("status") == "paused":
-                    logger.info(f"Job {schedule_id} paused for approval.")
-                    approval_entry = PendingApproval(
-                        id=str(uuid.uuid4()),
-                        execution_id=schedule_id,
-                        agent_id=tool_args.get("agent_id", "unknown"),
-                        tool_name=tool_name,
-                        arguments=tool_args,
-                        status="pending",
-                        session_id=session_id
+                prefix = self.llm_service.get_prefix_handle(system_prompt, self._tool_defs)
+
+                final_content = ""
+                for turn in range(5):
+                    response = await self.llm_service.generate(
+                        messages=messages,
+                        tools=self._tool_defs,
+                        max_tokens=1024,
+                        cache=False,  # Scheduled jobs must always see fresh state
+                        prefix=prefix
                     )
-                    db.add(approval_entry)
-                    db.commit()
-
-                    # Save approval request to chat
-                    self.data_manager.save_chat_message(
-                        session_id, 'assistant',
-                        f"🛡️ **Approval Required**\n\nTool: `{tool_name}`\nArgs: `{json.dumps(tool_args)}`",
-                        metadata={"type": "approval_request", "approval_id": approval_entry.id}
+
+                    tool_call = response.get("tool_call")
+                    content = response["content"]
+                    usage = response.get("usage", {})
+                    logger.debug(
+                        f"Job {schedule_id} turn {turn}: prompt={usage.get('prompt_tokens', 0)} "
+                        f"cached={usage.get('cached_tokens', 0)} (response {response.get('response_id')})"
                     )
-                    break
-            else:
-                final_content = "Agent stopped after max turns."
 
-            # Save final response to chat
-            if final_content:
-                self.data_manager.save_chat_message(session_id, 'assistant', final_content)
+                    if not tool_call:
+                        final_content = content
+                        logger.info(f"Job {schedule_id} finished: {content}")
+                        break
+
+                    # Execute Tool(s); independent calls from one reply run concurrently
+                    calls = response.get("tool_calls") or [tool_call]
+                    for call in calls:
+                        call.setdefault("params", {})
+                        if "agent_id" not in call["params"] and job.agent_id:
+                            call["params"]["agent_id"] = job.agent_id
 
-            # Mark session as unread
-            self.data_manager.mark_session_unread(session_id)
+                    if len(calls) > 1:
+                        tool_results = await self.tool_executor.execute_many(
+                            [(call["tool"], call["params"]) for call in calls]
+                        )
+                    else:
+                        tool_results = [await self.tool_executor.execute(tool_call["tool"], tool_call["params"], db=tool_db)]
+                        # Hand the connection back to the pool while the LLM runs; the
+                        # session itself is reused for the next tool call.
+                        tool_db.close()
+
+                    paused_call = None
+                    completed = []
+                    for call, tool_result in zip(calls, tool_results):
+                        # Kept structured; the LLM client encodes them once per request
+                        messages.append({"role": "assistant", "tool_call": call})
+                        messages.append({"role": "tool", "content": _clip_observation(tool_result)})
+                        if paused_call is None and tool_result.get("status") == "paused":
+                            paused_call = call
+                        else:
+                            completed.append({"tool": call["tool"], "result": tool_result})
+
+                    # Check for HITL pause
+                    if paused_call:
+                        tool_name = paused_call["tool"]
+                        tool_args = paused_call["params"]
+                        logger.info(f"Job {schedule_id} paused for approval.")
+                        approval_id = str(uuid.uuid4())
+                        async with self.data_manager.get_async_db() as s, s.begin():
+                            # execution_id is unique, so scope it to this run of the schedule
+                            await s.execute(self.data_manager.pending_approval_insert(
+                                id=approval_id,
+                                execution_id=f"{schedule_id}:{approval_id}",
+                                agent_id=tool_args.get("agent_id", "unknown"),
+                                tool_name=tool_name,
+                                arguments=tool_args,
+                                status="pending",
+                                session_id=session_id
+                            ))
+
+                        # Calls from the same reply already ran; record them so the resume,
+                        # which rebuilds its history from the chat, doesn't issue them again
+                        if completed:
+                            self.data_manager.save_chat_message(
+                                session_id, 'assistant',
+                                "🔧 **Completed before approval**\n\n" + "\n".join(
+                                    f"- `{c['tool']}`: `{_dumps(c['result'])[:200]}`" for c in completed
+                                ),
+                                metadata={"type": "tool_results", "results": completed}
+                            )
+
+                        # Save approval request to chat
+                        self.data_manager.save_chat_message(
+                            session_id, 'assistant',
+                            f"🛡️ **Approval Required**\n\nTool: `{tool_name}`\nArgs: `{_dumps(tool_args)}`",
+                            metadata={"type": "approval_request", "approval_id": approval_id}
+                        )
+                        break
+                else:
+                    final_content = "Agent stopped after max turns."
+
+                # Save final response to chat
+                if final_content:
+                    self.data_manager.save_chat_message(session_id, 'assistant', final_content)
+
+                # Mark session as unread
+                self.data_manager.mark_session_unread(session_id)
 
         except Exception as e:
             logger.error(f"Job {schedule_id} failed: {e}")
-        finally:
-            db.close()
@@ -4,12 +4,21 @@ Agent Tools - Defines tools that the LLM can use to control agents.
 These tools send JSON-RPC commands to connected agents.
 """
 
+import asyncio
+import copy
 import logging
-import json
+import time
 import uuid
-from typing import Dict, Any, List, Optional
+from datetime import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models.db import Agent
 from app.services.data_manager import DataManager
 from app.core.dependencies import get_agent_manager
+from app.services.errors import ApprovalRequiredError
 
 logger = logging.getLogger(__name__)
 
@@ -61,263 +70,354 @@ AGENT_TOOLS = [
 ]
 
 
+# Immutable view of AGENT_TOOLS computed once at import, reused on every LLM turn
+_AGENT_TOOLS_FROZEN = tuple(AGENT_TOOLS)
+
+
+# Names accepted by ToolExecutor.execute
+_VALID_TOOL_NAMES = frozenset(t["name"] for t in AGENT_TOOLS)
+_VALID_TOOL_NAMES_STR = ", ".join(t["name"] for t in AGENT_TOOLS)
+
+# Underlying shell commands each tool runs, for HITL policy matching.
+# run_command is resolved dynamically from its 'command' parameter.
+_TOOL_TO_COMMANDS = {
+    "list_files": ("ls",),
+    "read_file": ("cat",),
+    "run_command": (),
+    "get_system_info": ("uname", "sysinfo"),
+    "get_agent_details": (),
+}
+
+# Tools answered from the database alone; every other tool needs a live agent
+_DB_ONLY_TOOLS = frozenset({"list_agents", "get_agent_details"})
+
+# Upper bound on concurrently running calls in ToolExecutor.execute_many()
+_MAX_PARALLEL_TOOLS = 8
+
+# Read-only tools whose results may be briefly reused for identical parameters
+_CACHEABLE_TOOLS = frozenset({"list_agents", "get_agent_details", "get_system_info", "list_files", "read_file"})
+_RESULT_CACHE_SIZE = 128
+_RESULT_CACHE_TTL = 5.0
+
+
 class ToolExecutor:
     """Executes tools by dispatching commands to agents."""
     
-    def __init__(self, data_manager: DataManager, comm_manager=None):
+    def __init__(self, data_manager: DataManager, result_cache_ttl: float = _RESULT_CACHE_TTL):
         self.db = data_manager
         self.agent_manager = get_agent_manager() # Use Dependency Injection
-        self.pending_requests: Dict[str, Any] = {}
+        # Caps how many tool calls from one execute_many() batch run at once
+        self._tool_sem = asyncio.Semaphore(_MAX_PARALLEL_TOOLS)
+        # tool_name -> (required params, handler); handlers take the required params
+        # as keyword arguments plus approved_by and db
+        self._handlers = {
+            "list_agents": ((), self._list_agents),
+            "run_command": (("agent_id", "command"), self._run_command),
+            "get_system_info": (("agent_id",), self._get_system_info),
+            "list_files": (("agent_id", "path"), self._list_files),
+            "read_file": (("agent_id", "path"), self._read_file),
+            "get_agent_details": (("agent_id",), self._get_agent_details),
+        }
+        # (tool_name, params) -> (expires_at, result) for read-only tools, oldest first
+        self._result_cache: "OrderedDict[tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.result_cache_ttl = result_cache_ttl
     
-    async def execute(self, tool_name: str, params: Dict[str, Any], approved_by: Optional[str] = None) -> Dict[str, Any]:
-        """Execute a tool and return the result."""
+    def _result_cache_key(self, tool_name: str, params: Dict[str, Any], approved_by: Optional[str]) -> Optional[tuple]:
+        """Cache key for a read-only tool call, or None if the call must not be cached."""
+        if tool_name not in _CACHEABLE_TOOLS or approved_by or self.result_cache_ttl <= 0:
+            return None
+        try:
+            return (tool_name, frozenset(params.items()))
+        except TypeError:
+            return None  # Unhashable parameter values
+
+    def _cache_get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        entry = self._result_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._result_cache[key]
+            return None
+        self._result_cache.move_to_end(key)
+        return copy.deepcopy(entry[1])
+
+    def _cache_put(self, key: tuple, result: Dict[str, Any]):
+        self._result_cache[key] = (time.monotonic() + self.result_cache_ttl, copy.deepcopy(result))
+        self._result_cache.move_to_end(key)
+        while len(self._result_cache) > _RESULT_CACHE_SIZE:
+            self._result_cache.popitem(last=False)
+
+    def _cache_drop_agent(self, agent_id: str):
+        """Forget cached results for an agent; anything not read-only may have changed its state."""
+        item = ("agent_id", agent_id)
+        for key in [k for k in self._result_cache if item in k[1]]:
+            del self._result_cache[key]
+
+    async def execute(self, tool_name: str, params: Dict[str, Any], approved_by: Optional[str] = None, db: Optional[Session] = None) -> Dict[str, Any]:
+        """
+        Execute a tool and return the result.
+        If `db` is given it is used for all database work; otherwise a session is
+        opened for the duration of this call.
+        """
+        if db is not None:
+            return await self._execute(tool_name, params, approved_by, db)
+        with self.session_scope() as own_db:
+            return await self._execute(tool_name, params, approved_by, own_db)
+
+    @contextmanager
+    def session_scope(self) -> Iterator[Session]:
+        """One session shared by every tool method for the duration of a call."""
+        db = self.db.SessionLocal()
+        try:
+            yield db
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def execute_many(self, calls: List[Tuple[str, Dict[str, Any]]], approved_by: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Execute independent tool calls concurrently, returning results in call order.
+        Each call gets its own DB session since sessions can't be shared across tasks.
+        """
+        async def bounded(name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+            async with self._tool_sem:
+                return await self.execute(name, params, approved_by)
+
+        results = await asyncio.gather(
+            *(bounded(name, params) for name, params in calls),
+            return_exceptions=True
+        )
+        return [
+            {"status": "error", "message": f"Execution failed: {r}"} if isinstance(r, BaseException) else r
+            for r in results
+        ]
+
+    async def _execute(self, tool_name: str, params: Dict[str, Any], approved_by: Optional[str], db: Session) -> Dict[str, Any]:
         logger.info(f"Executing tool: {tool_name} with params: {params} (approved_by={approved_by})")
         
         # 1. Validate Tool Existence
-        valid_tools = [t['name'] for t in AGENT_TOOLS]
-        if tool_name not in valid_tools:
+        if tool_name not in _VALID_TOOL_NAMES:
             return {
                 "status": "error", 
-                "message": f"Tool '{tool_name}' does not exist. Available tools: {', '.join(valid_tools)}. Please verify the tool name and try again."
+                "message": f"Tool '{tool_name}' does not exist. Available tools: {_VALID_TOOL_NAMES_STR}. Please verify the tool name and try again."
             }
 
-        # 2. Server-side HITL Policy Check
+        missing = [p for p in self._handlers[tool_name][0] if p not in params]
+        if missing:
+            plural = "s" if len(missing) > 1 else ""
+            return {
+                "status": "error",
+                "message": f"Missing required parameter{plural}: {' and '.join(repr(p) for p in missing)}"
+            }
+
+        # Fail fast for offline agents before paying for the policy lookup
         agent_id = params.get("agent_id")
-        if agent_id and not approved_by and tool_name != "list_agents":
+        if agent_id and tool_name not in _DB_ONLY_TOOLS and agent_id not in self.agent_manager.active_connections:
+            return {"status": "error", "message": f"Agent {agent_id} not connected"}
+
+        # 2. Server-side policy check, answered locally without an agent round-trip
+        if agent_id and tool_name != "list_agents":
             try:
-                policy = self.db.get_agent_policy(agent_id)
-                if policy.get('hitl_enabled', False):
-                    requires_approval = [x.strip().lower() for x in policy.get('requires_approval_for', []) if x.strip()]
-                    blocked_commands = [x.strip().lower() for x in policy.get('blocked_commands', []) if x.strip()]
-
-                    # Map tool names to underlying shell commands for matching
-                    TOOL_TO_COMMANDS = {
-                        "list_files": ["ls"],
-                        "read_file": ["cat"],
-                        "run_command": [],  # dynamic — checked via params
-                        "get_system_info": ["uname", "sysinfo"],
-                        "get_agent_details": [],
-                    }
+                policy = self.db.get_normalized_policy(agent_id)
+                requires_approval = policy["requires_approval"]
+                blocked_commands = policy["blocked_commands"]
+
+                # Resolve the actual shell command(s) this tool will execute
+                tool_commands = _TOOL_TO_COMMANDS.get(tool_name, ())
+                full_command = None
+                if tool_name == "run_command" and "command" in params:
+                    # Extract the base command; maxsplit=1 stops after the first token
+                    head = params["command"].split(maxsplit=1)
+                    tool_commands = (head[0].lower(),) if head else ()
+                    full_command = params["command"].strip().lower()
 
-                    # Resolve the actual shell command(s) this tool will execute
-                    tool_commands = TOOL_TO_COMMANDS.get(tool_name, [])
-                    if tool_name == "run_command" and "command" in params:
-                        # Extract the base command from the full command string
-                        shell_cmd = params["command"].strip().split()[0].lower() if params["command"].strip() else ""
-                        tool_commands = [shell_cmd] if shell_cmd else []
+                # Check blocked_commands: match on tool name, underlying command or
+                # the full command line. Blocked is blocked, approved or not.
+                if tool_name.lower() in blocked_commands:
+                    return {
+                        "status": "error",
+                        "message": f"Tool '{tool_name}' is blocked by security policy for agent {agent_id}."
+                    }
+                cmd = next((c for c in tool_commands if c in blocked_commands), None)
+                if cmd is None and full_command in blocked_commands:
+                    cmd = full_command
+                if cmd:
+                    return {
+                        "status": "error",
+                        "message": f"Command '{cmd}' is blocked by security policy for agent {agent_id}."
+                    }
 
-                    # Check requires_approval: match on tool name OR underlying command
+                # Check requires_approval: match on tool name OR underlying command
+                if policy["hitl_enabled"] and not approved_by:
                     if tool_name.lower() in requires_approval:
                         logger.info(f"HITL: Tool '{tool_name}' requires approval for agent {agent_id}")
                         return {
                             "status": "paused",
                             "message": f"Tool '{tool_name}' requires human approval for agent {agent_id}."
                         }
-                    for cmd in tool_commands:
-                        if cmd in requires_approval:
-                            logger.info(f"HITL: Command '{cmd}' (via tool '{tool_name}') requires approval for agent {agent_id}")
-                            return {
-                                "status": "paused",
-                                "message": f"Command '{cmd}' requires human approval for agent {agent_id}."
-                            }
-
-                    # Check blocked_commands: match on tool name OR underlying command
-                    if tool_name.lower() in blocked_commands:
+                    cmd = next((c for c in tool_commands if c in requires_approval), None)
+                    if cmd:
+                        logger.info(f"HITL: Command '{cmd}' (via tool '{tool_name}') requires approval for agent {agent_id}")
                         return {
-                            "status": "error",
-                            "message": f"Tool '{tool_name}' is blocked by security policy for agent {agent_id}."
+                            "status": "paused",
+                            "message": f"Command '{cmd}' requires human approval for agent {agent_id}."
                         }
-                    for cmd in tool_commands:
-                        if cmd in blocked_commands:
-                            return {
-                                "status": "error",
-                                "message": f"Command '{cmd}' is blocked by security policy for agent {agent_id}."
-                            }
 
             except Exception as e:
                 logger.warning(f"HITL policy check failed: {e}")
 
+        # 3. Serve repeated read-only calls from the short-lived result cache
+        cache_key = self._result_cache_key(tool_name, params, approved_by)
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"Tool cache hit: {tool_name}")
+                return cached
+
+        result = await self._dispatch(tool_name, params, approved_by, db)
+        if cache_key is not None:
+            if result.get("success"):
+                self._cache_put(cache_key, result)
+        elif agent_id:
+            self._cache_drop_agent(agent_id)
+        return result
+
+    async def _dispatch(self, tool_name: str, params: Dict[str, Any], approved_by: Optional[str], db: Session) -> Dict[str, Any]:
+        """Run the tool handler, translating agent errors into result dicts."""
+        required, handler = self._handlers[tool_name]
         try:
-            if tool_name == "list_agents":
-                return await self._list_agents()
-            elif tool_name == "run_command":
-                if "agent_id" not in params or "command" not in params:
-                    return {"status": "error", "message": "Missing required parameters: 'agent_id' and 'command'"}
-                return await self._run_command(params["agent_id"], params["command"], approved_by)
-            elif tool_name == "get_system_info":
-                if "agent_id" not in params:
-                    return {"status": "error", "message": "Missing required parameter: 'agent_id'"}
-                return await self._get_system_info(params["agent_id"])
-            elif tool_name == "list_files":
-                if "agent_id" not in params or "path" not in params:
-                    return {"status": "error", "message": "Missing required parameters: 'agent_id' and 'path'"}
-                return await self._list_files(params["agent_id"], params["path"], approved_by)
-            elif tool_name == "read_file":
-                if "agent_id" not in params or "path" not in params:
-                    return {"status": "error", "message": "Missing required parameters: 'agent_id' and 'path'"}
-                return await self._read_file(params["agent_id"], params["path"], approved_by)
-            elif tool_name == "get_agent_details":
-                if "agent_id" not in params:
-                    return {"status": "error", "message": "Missing required parameter: 'agent_id'"}
-                return await self._get_agent_details(params["agent_id"])
-            else:
-                return {"status": "error", "message": f"Unknown tool: {tool_name}"}
+            return await handler(**{p: params[p] for p in required}, approved_by=approved_by, db=db)
+        except ApprovalRequiredError as e:
+            # HITL Flow: the agent paused the action (-32001) pending admin approval
+            logger.info(f"Tool {tool_name} requires approval (execution_id={e.execution_id})")
+            execution_id = e.execution_id or f"need-approval-{uuid.uuid4()}"
+            
+            try:
+                db.rollback()  # Discard any half-finished work from the failed call
+                async with self.db.get_async_db() as s:
+                    # The unique index on execution_id turns duplicates into no-ops
+                    await s.execute(self.db.pending_approval_insert(
+                        id=str(uuid.uuid4()),
+                        execution_id=execution_id,
+                        agent_id=params.get("agent_id", "unknown"),
+                        tool_name=tool_name,
+                        arguments=params,
+                        status="pending"
+                    ))
+                    await s.commit()
+            except Exception as db_e:
+                logger.error(f"Failed to save pending approval: {db_e}")
+            
+            return {
+                "status": "paused", 
+                "message": "Action requires approval. Admin notified. Please wait for approval."
+            }
         except Exception as e:
             logger.error(f"Tool execution failed: {e}")
-            error_msg = str(e)
-            
-            # Check for HITL specific error code from Agent (-32001)
-            if "Action requires approval" in error_msg or "-32001" in error_msg:
-                # HITL Flow
-                import re
-                match = re.search(r'execution_id":\s*"([^"]+)"', error_msg)
-                execution_id = match.group(1) if match else f"need-approval-{uuid.uuid4()}"
-                
-                from app.core.dependencies import get_db
-                from app.models.db import PendingApproval
-                
-                try:
-                    db = next(get_db())
-                    # Check if already exists to prevent duplicates
-                    exists = db.query(PendingApproval).filter(PendingApproval.execution_id == execution_id).first()
-                    if not exists:
-                        approval = PendingApproval(
-                            id=str(uuid.uuid4()),
-                            execution_id=execution_id,
-                            agent_id=params.get("agent_id", "unknown"),
-                            tool_name=tool_name,
-                            arguments=params,
-                            status="pending"
-                        )
-                        db.add(approval)
-                        db.commit()
-                        db.close()
-                except Exception as db_e:
-                    logger.error(f"Failed to save pending approval: {db_e}")
-                
-                return {
-                    "status": "paused", 
-                    "message": "Action requires approval. Admin notified. Please wait for approval."
-                }
-
             return {"status": "error", "message": f"Execution failed: {str(e)}"}
     
-    async def _list_agents(self) -> Dict[str, Any]:
+    async def _list_agents(self, approved_by: Optional[str] = None, *, db: Session) -> Dict[str, Any]:
         """List all connected agents from the database."""
-        db = self.db.get_db()
-        try:
-            from app.models.db import Agent
-            agents = db.query(Agent).all()
-            agent_list = [{
-                "id": a.id,
-                "hostname": a.hostname,
-                "status": a.status,
-                "platform": a.platform,
-                "last_seen": a.last_seen.isoformat() if a.last_seen else None
-            } for a in agents]
-            return {
-                "success": True,
-                "agents": agent_list,
-                "count": len(agent_list)
-            }
-        finally:
-            db.close()
+        async with self.db.get_async_db() as s:
+            rows = (await s.execute(
+                select(Agent.id, Agent.hostname, Agent.status, Agent.platform, Agent.last_seen)
+            )).all()
+        iso = datetime.isoformat
+        agent_list = [{
+            "id": agent_id,
+            "hostname": hostname,
+            "status": status,
+            "platform": platform,
+            "last_seen": iso(last_seen) if last_seen else None
+        } for agent_id, hostname, status, platform, last_seen in rows]
+        return {
+            "success": True,
+            "agents": agent_list,
+            "count": len(agent_list)
+        }
     
-    async def _run_command(self, agent_id: str, command: str, approved_by: Optional[str] = None) -> Dict[str, Any]:
+    async def _run_command(self, agent_id: str, command: str, approved_by: Optional[str] = None, *, db: Session) -> Dict[str, Any]:
         """Execute a shell command on an agent and return the real result."""
-        db = self.db.get_db()
-        try:
-            parts = command.split()
-            cmd_name = parts[0]
-            cmd_args = parts[1:] if len(parts) > 1 else []
-            
-            result = await self.agent_manager.send_command(
-                agent_id=agent_id,
-                tool_name="exec_command",
-                arguments={
-                    "command": cmd_name,
-                    "args": cmd_args,
-                    "timeout": 30
-                },
-                db=db,
-                approved_by=approved_by  # Pass approval
-            )
-            return {"success": True, "output": result.get("output", ""), "agent_id": agent_id}
-        finally:
-            db.close()
+        cmd_name, *rest = command.split(maxsplit=1)
+        cmd_args = rest[0].split() if rest else []
+        
+        result = await self.agent_manager.send_command(
+            agent_id=agent_id,
+            tool_name="exec_command",
+            arguments={
+                "command": cmd_name,
+                "args": cmd_args,
+                "timeout": 30
+            },
+            db=db,
+            approved_by=approved_by  # Pass approval
+        )
+        return {"success": True, "output": result.get("output", ""), "agent_id": agent_id}
     
-    async def _get_system_info(self, agent_id: str) -> Dict[str, Any]:
-        db = self.db.get_db()
-        try:
-            result = await self.agent_manager.send_command(
-                agent_id=agent_id,
-                tool_name="get_system_info",
-                arguments={},
-                db=db
-            )
-            return {"success": True, "info": result, "agent_id": agent_id}
-        finally:
-            db.close()
+    async def _get_system_info(self, agent_id: str, approved_by: Optional[str] = None, *, db: Session) -> Dict[str, Any]:
+        result = await self.agent_manager.send_command(
+            agent_id=agent_id,
+            tool_name="get_system_info",
+            arguments={},
+            db=db
+        )
+        return {"success": True, "info": result, "agent_id": agent_id}
     
-    async def _list_files(self, agent_id: str, path: str, approved_by: Optional[str] = None) -> Dict[str, Any]:
-        db = self.db.get_db()
-        try:
-            result = await self.agent_manager.send_command(
-                agent_id=agent_id,
-                tool_name="exec_command",
-                arguments={
-                    "command": "ls",
-                    "args": ["-la", path],
-                    "timeout": 10
-                },
-                db=db,
-                approved_by=approved_by
-            )
-            return {"success": True, "output": result.get("output", ""), "path": path}
-        finally:
-            db.close()
+    async def _list_files(self, agent_id: str, path: str, approved_by: Optional[str] = None, *, db: Session) -> Dict[str, Any]:
+        result = await self.agent_manager.send_command(
+            agent_id=agent_id,
+            tool_name="exec_command",
+            arguments={
+                "command": "ls",
+                "args": ["-la", path],
+                "timeout": 10
+            },
+            db=db,
+            approved_by=approved_by
+        )
+        return {"success": True, "output": result.get("output", ""), "path": path}
     
-    async def _read_file(self, agent_id: str, path: str, approved_by: Optional[str] = None) -> Dict[str, Any]:
-        db = self.db.get_db()
-        try:
-            result = await self.agent_manager.send_command(
-                agent_id=agent_id,
-                tool_name="exec_command",
-                arguments={
-                    "command": "cat",
-                    "args": [path],
-                    "timeout": 10
-                },
-                db=db,
-                approved_by=approved_by
-            )
-            return {"success": True, "content": result.get("output", ""), "path": path}
-        finally:
-            db.close()
+    async def _read_file(self, agent_id: str, path: str, approved_by: Optional[str] = None, *, db: Session) -> Dict[str, Any]:
+        result = await self.agent_manager.send_command(
+            agent_id=agent_id,
+            tool_name="exec_command",
+            arguments={
+                "command": "cat",
+                "args": [path],
+                "timeout": 10
+            },
+            db=db,
+            approved_by=approved_by
+        )
+        return {"success": True, "content": result.get("output", ""), "path": path}
     
-    async def _get_agent_details(self, agent_id: str) -> Dict[str, Any]:
-        db = self.db.get_db()
-        try:
-            from app.models.db import Agent
-            agent = db.query(Agent).filter(Agent.id == agent_id).first()
-            if not agent:
-                return {"error": f"Agent {agent_id} not found"}
-            
-            return {
-                "success": True,
-                "agent": {
-                    "id": agent.id,
-                    "hostname": agent.hostname,
-                    "status": agent.status,
-                    "platform": agent.platform,
-                    "os_info": agent.os_info,
-                    "capabilities": agent.capabilities,
-                    "last_seen": agent.last_seen.isoformat() if agent.last_seen else None
-                }
+    async def _get_agent_details(self, agent_id: str, approved_by: Optional[str] = None, *, db: Session) -> Dict[str, Any]:
+        async with self.db.get_async_db() as s:
+            row = (await s.execute(
+                select(Agent.hostname, Agent.status, Agent.platform, Agent.os_info,
+                       Agent.capabilities, Agent.last_seen)
+                .where(Agent.id == agent_id)
+                .limit(1)
+            )).first()
+        if not row:
+            return {"error": f"Agent {agent_id} not found"}
+        
+        hostname, status, platform, os_info, capabilities, last_seen = row
+        return {
+            "success": True,
+            "agent": {
+                "id": agent_id,
+                "hostname": hostname,
+                "status": status,
+                "platform": platform,
+                "os_info": os_info,
+                "capabilities": capabilities,
+                "last_seen": last_seen.isoformat() if last_seen else None
             }
-        finally:
-            db.close()
+        }
 
-def get_tool_definitions() -> List[Dict[str, Any]]:
+def get_tool_definitions() -> Tuple[Dict[str, Any], ...]:
     """Get tool definitions for the LLM."""
-    return AGENT_TOOLS
\ No newline at end of file
+    return _AGENT_TOOLS_FROZEN
\ No newline at end of file
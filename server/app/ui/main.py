@@ -1,28 +1,170 @@
 # server/app/ui/main.py
-from nicegui import ui, app
-from app.services.data_manager import DataManager
+from nicegui import ui, app, background_tasks
+from sqlalchemy import bindparam, delete, select, update
+from app.core.dependencies import get_agent_manager, get_data_manager, get_scheduler_service
+from app.models.db import Agent, PendingApproval, Schedule
 from app.services.model_manager import get_model_manager, MODELS_DIR
 from app.services.llm_service import get_llm_service
 from app.services.tools import ToolExecutor, get_tool_definitions
-from app.services.scheduler import SchedulerService
+from app.services.scheduler import parse_cron
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 import asyncio
 import logging
+import time
 import uuid
-import json
+import orjson
 
 logger = logging.getLogger(__name__)
 
-# Singletons
-data_manager = DataManager()
-scheduler_service = SchedulerService()
+# Singletons shared with the API, so caches and scheduled jobs stay coherent
+data_manager = get_data_manager()
+scheduler_service = get_scheduler_service()
+
+# Tool definitions are immutable; fetch them once instead of every agent turn
+TOOL_DEFS = get_tool_definitions()
+
+
+def _parse_csv(value: str) -> list:
+    """Split a comma-separated textarea value into stripped, non-empty items."""
+    return [t for t in (p.strip() for p in value.split(',')) if t]
+
+
+def _coerce(value, default, cast=None):
+    """A widget's event value, or `default` when it arrives as a dict (corrupted/cleared input)."""
+    if isinstance(value, dict):
+        return default
+    return cast(value) if cast else value
+
+
+# System prompt used until the user saves their own in Model Settings
+DEFAULT_SYSTEM_PROMPT = (
+    "You are FabriCore, an AI assistant that helps manage computer systems through connected agents. "
+    "Be concise and helpful. When you need to perform actions, use the available tools."
+)
+
+# Messages an agent loop keeps after its system prompt; older turns roll off
+LOOP_HISTORY_MAX = 64
+
+# Schedule statements reused by every dialog action, so they're built only once
+_TOGGLE_SCHEDULE = (
+    update(Schedule)
+    .where(Schedule.id == bindparam("schedule_id"))
+    .values(is_active=~Schedule.is_active)
+    .returning(
+        Schedule.is_active, Schedule.cron_expression, Schedule.task_instruction,
+        Schedule.required_model, Schedule.agent_id
+    )
+)
+_DELETE_SCHEDULE = delete(Schedule).where(Schedule.id == bindparam("schedule_id"))
+_LIST_SCHEDULES = select(
+    Schedule.id, Schedule.cron_expression, Schedule.task_instruction,
+    Schedule.required_model, Schedule.agent_id,
+    Schedule.use_persistent_chat, Schedule.is_active
+)
+_LIST_AGENTS = select(Agent.id, Agent.hostname, Agent.platform, Agent.arch, Agent.status)
+
+# The Agents panel re-queries at most this often (seconds); clicks in between reuse the last rows
+AGENTS_PANEL_TTL = 2.0
+
+# Left-border colour of an agent card per status; anything not listed renders as offline
+_AGENT_CARD_BORDERS = {'online': 'border-green-500'}
+_AGENT_CARD_OFFLINE = 'border-gray-400'
+_AGENT_CARD_ALL_BORDERS = ' '.join({*_AGENT_CARD_BORDERS.values(), _AGENT_CARD_OFFLINE})
+
+# HuggingFace search-as-you-type: wait this long after the last keystroke (seconds),
+# and ignore queries shorter than SEARCH_MIN_CHARS. Enter and the search button fire at once.
+SEARCH_DEBOUNCE = 0.3
+SEARCH_MIN_CHARS = 3
+
+# Rows per page of HuggingFace search results; the full result set stays on the server
+MODELS_PAGE_SIZE = 25
+
+# Delay used to coalesce bursts of scheduler dialog refreshes (seconds)
+SCHEDULE_REFRESH_DEBOUNCE = 0.05
+
+# Model Settings changes are persisted to user storage in one write at most this long after
+# the first queued change (seconds), so a long slider drag still saves periodically
+STORAGE_FLUSH_DELAY = 0.25
+# Minimum interval between value events sent by a dragged slider or a held number spinner (seconds)
+SETTINGS_INPUT_THROTTLE = 0.1
+
+# Messages rendered when a chat is opened, and per "Load earlier messages" click
+CHAT_PAGE_SIZE = 50
+
+# Off-screen chat messages skip style, layout and paint; `auto` keeps each message's last
+# rendered height as its placeholder so scrolling doesn't jump
+_CHAT_LOG_CSS = '<style>.chat-log > * { content-visibility: auto; contain-intrinsic-size: auto 120px; }</style>'
+
+
+# Performance Guide tab: (section title, HTML body). Static, so it's joined into one string below.
+_GUIDE_SECTIONS = [
+    ('🐧 Linux Tuning (AMD/Nvidia)', """
+<p><strong>AMD GPU (Vulkan/ROCm)</strong></p>
+<p>1. <strong>Increase VRAM Limit</strong>: Modern way to allow more allocation for shared memory.</p>
+<pre><code>sudo nano /etc/modprobe.d/amdgpu.conf
+# Add: options ttm pages_limit=xxxx
+sudo update-initramfs -u</code></pre>
+<p>2. <strong>Enable GPL</strong>: Helps with shader compilation and performance.</p>
+<pre><code>RADV_PERFTEST=gpl</code></pre>
+<hr>
+<p><strong>Nvidia GPU</strong></p>
+<p>1. <strong>Persistence Mode</strong>: Keeps the driver loaded and prevents startup lag.</p>
+<pre><code>sudo nvidia-smi -pm 1</code></pre>
+"""),
+    ('🪟 Windows Tuning', """
+<p>1. <strong>HAGS</strong>: Enable "Hardware-accelerated GPU scheduling" in Graphics Settings.</p>
+<p>2. <strong>Pagefile</strong>: Ensure you have a large pagefile (16GB+) on an SSD if using Large Context.</p>
+<p>3. <strong>Graphics Performance</strong>: Set Python/Docker to "High Performance" in Windows Graphics settings.</p>
+"""),
+    ('🍎 macOS Tuning (Apple Silicon)', """
+<p>1. <strong>Unified Memory</strong>: Apple Silicon automatically shares memory. Close other apps to give LLM more RAM.</p>
+<p>2. <strong>Metal</strong>: FabriCore uses Vulkan/Metal backends. Ensure you are on the latest macOS version for optimal driver performance.</p>
+"""),
+]
+
+
+def _build_guide_html() -> str:
+    """The Performance Guide as one HTML string, with each section in a collapsible <details>."""
+    parts = ['<div class="text-lg font-bold mb-4">Hardware Optimization Guide</div>']
+    for title, body in _GUIDE_SECTIONS:
+        parts.append(
+            '<details class="w-full border rounded-lg mb-2">'
+            f'<summary class="p-3 cursor-pointer font-medium">{title}</summary>'
+            f'<div class="px-4 pb-2">{body}</div>'
+            '</details>'
+        )
+    parts.append(
+        '<div class="text-sm italic text-primary mt-4">Pro Tip: Use Flash Attention and Q8/Q4 KV Cache '
+        'in "Model Settings" to save up to 40% VRAM!</div>'
+    )
+    return ''.join(parts)
+
+
+_GUIDE_HTML = _build_guide_html()
+
+
+def _dumps(obj, *, indent: bool = False) -> str:
+    """orjson-backed json.dumps for tool calls, results and arguments shown in chat."""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0, default=str).decode()
+
+
+@lru_cache(maxsize=4096)
+def _agent_label(hostname: Optional[str], agent_id: str) -> str:
+    """'hostname (abcdef123456...)' label for an agent, or just the short id without a hostname."""
+    short_id = f"{agent_id[:12]}..."
+    return f"{hostname} ({short_id})" if hostname else short_id
+
+
+@lru_cache(maxsize=8)
+def _system_message(prompt: str) -> dict:
+    """Shared, read-only system message for a prompt string."""
+    return {"role": "system", "content": prompt}
 
 def init_ui():
-
-    # Start Scheduler on App Startup
-    app.on_startup(scheduler_service.start)
-
+    # scheduler_service is started once, by app.main's startup event
     @ui.page('/', title='FabriCore')
     async def main_page():
         # --- Sanity check for session storage ---
@@ -34,6 +176,7 @@ def init_ui():
                 logger.warning(f"Sanitized corrupted UI state for {key}: reset to {app.storage.user[key]}")
 
         # Dark mode
+        ui.add_head_html(_CHAT_LOG_CSS)
         dark = ui.dark_mode()
         is_dark = app.storage.user.get('dark_mode', False)
         if is_dark:
@@ -50,6 +193,10 @@ def init_ui():
 
         # Chat state
         chat_messages = []
+        # approval_id -> loop_messages of an agent loop paused for HITL, for cheap resumption
+        paused_loops = {}
+        # Timestamp of the oldest message rendered for the active session
+        oldest_loaded = None
         app.storage.user.setdefault('current_session_id', None)
         active_session_id = app.storage.user['current_session_id']
 
@@ -58,10 +205,31 @@ def init_ui():
         context_label = None
         context_bar = None
 
+        # Model Settings changes not yet written to app.storage.user (see queue_storage)
+        pending_storage = {}
+        storage_flush = {"handle": None}
+
+        def flush_storage():
+            """Write queued settings now; call before anything reads them back from storage."""
+            if storage_flush["handle"]:
+                storage_flush["handle"].cancel()
+                storage_flush["handle"] = None
+            if pending_storage:
+                app.storage.user.update(pending_storage)
+                pending_storage.clear()
+
+        def queue_storage(key: str, value):
+            """Queue a settings write; everything queued within STORAGE_FLUSH_DELAY is persisted together."""
+            pending_storage[key] = value
+            if storage_flush["handle"] is None:
+                storage_flush["handle"] = asyncio.get_running_loop().call_later(STORAGE_FLUSH_DELAY, flush_storage)
+
         # =====================================================================
         # SETTINGS DIALOG
         # =====================================================================
+        # Built once per page and reused by every open; only live data is synced when it is shown
         settings_dialog = ui.dialog().props('maximized')
+        settings_dialog.on_value_change(lambda e: refresh_agents_panel() if e.value else flush_storage())
 
         def open_settings():
             settings_dialog.open()
@@ -81,105 +249,108 @@ def init_ui():
 
                 with ui.tab_panels(settings_tabs, value=agent_tab).classes('w-full').style('min-height: 400px'):
                     # --- Performance Guide Tab ---
-                    with ui.tab_panel(guide_tab):
-                        ui.label('Hardware Optimization Guide').classes('text-lg font-bold mb-4')
-
-                        with ui.expansion('🐧 Linux Tuning (AMD/Nvidia)', icon='settings_suggest').classes('w-full border rounded-lg mb-2'):
-                            with ui.column().classes('p-4 gap-2'):
-                                ui.markdown('**AMD GPU (Vulkan/ROCm)**')
-                                ui.markdown('1. **Increase VRAM Limit**: Modern way to allow more allocation for shared memory.')
-                                ui.code('sudo nano /etc/modprobe.d/amdgpu.conf\n# Add: options ttm pages_limit=xxxx\nsudo update-initramfs -u')
-                                ui.markdown('2. **Enable GPL**: Helps with shader compilation and performance.')
-                                ui.code('RADV_PERFTEST=gpl')
-                                ui.separator().classes('my-2')
-                                ui.markdown('**Nvidia GPU**')
-                                ui.markdown('1. **Persistence Mode**: Keeps the driver loaded and prevents startup lag.')
-                                ui.code('sudo nvidia-smi -pm 1')
-
-                        with ui.expansion('🪟 Windows Tuning', icon='desktop_windows').classes('w-full border rounded-lg mb-2'):
-                            with ui.column().classes('p-4 gap-2'):
-                                ui.markdown('1. **HAGS**: Enable "Hardware-accelerated GPU scheduling" in Graphics Settings.')
-                                ui.markdown('2. **Pagefile**: Ensure you have a large pagefile (16GB+) on an SSD if using Large Context.')
-                                ui.markdown('3. **Graphics Performance**: Set Python/Docker to "High Performance" in Windows Graphics settings.')
-
-                        with ui.expansion('🍎 macOS Tuning (Apple Silicon)', icon='laptop_mac').classes('w-full border rounded-lg mb-2'):
-                            with ui.column().classes('p-4 gap-2'):
-                                ui.markdown('1. **Unified Memory**: Apple Silicon automatically shares memory. Close other apps to give LLM more RAM.')
-                                ui.markdown('2. **Metal**: FabriCore uses Vulkan/Metal backends. Ensure you are on the latest macOS version for optimal driver performance.')
-
-                        ui.label('Pro Tip: Use Flash Attention and Q8/Q4 KV Cache in "Model Settings" to save up to 40% VRAM!').classes('text-sm italic text-primary mt-4')
+                    guide_panel = ui.tab_panel(guide_tab)
+
+                    def render_guide_tab():
+                        # Trusted static markup, so skip client-side sanitizing
+                        ui.html(_GUIDE_HTML, sanitize=False).classes('w-full')
 
                     # --- Agents Tab (Status + Security Policy) ---
                     with ui.tab_panel(agent_tab):
                         ui.label('Connected Agents & Security').classes('text-lg font-bold mb-2')
                         agents_container = ui.column().classes('w-full gap-4')
+                        with agents_container:
+                            no_agents_label = ui.label("No agents registered.").classes('italic text-gray-500')
+                        no_agents_label.set_visibility(False)
+
+                        # Last rows read and when; agent_id -> {"row", "card", "title", "meta"} for rendered cards
+                        agents_snapshot = {"at": 0.0, "rows": []}
+                        agent_cards = {}
+
+                        def open_policy_dialog(agent_id: str):
+                            a = agent_cards[agent_id]["row"]
+                            current_policy = data_manager.get_agent_policy(a.id)
+
+                            with ui.dialog() as p_dialog, ui.card().classes('w-full max-w-2xl'):
+                                ui.label(f'Security Policy: {a.hostname}').classes('text-xl font-bold mb-2')
+
+                                hitl_switch = ui.switch('Enable Human-in-the-Loop (HITL)', value=current_policy.get('hitl_enabled', False))
+
+                                ui.label('Blocked Commands (comma separated)').classes('font-bold mt-2')
+                                blocked_input = ui.textarea(value=",".join(current_policy.get('blocked_commands', []))).classes('w-full')
+
+                                ui.label('Require Approval For (tools, comma separated)').classes('font-bold mt-2')
+                                approval_input = ui.textarea(value=",".join(current_policy.get('requires_approval_for', []))).classes('w-full')
+
+                                async def save_policy():
+                                    new_policy = {
+                                        "hitl_enabled": hitl_switch.value,
+                                        "blocked_commands": _parse_csv(blocked_input.value),
+                                        "requires_approval_for": _parse_csv(approval_input.value)
+                                    }
+                                    if data_manager.update_agent_policy(a.id, new_policy):
+                                        am = get_agent_manager()
+                                        await am.sync_policy(a.id, new_policy)
+                                        ui.notify(f"Policy synced to {a.hostname}", type='positive')
+                                        p_dialog.close()
+                                    else:
+                                        ui.notify("Failed to update policy", type='negative')
+
+                                with ui.row().classes('w-full justify-end mt-4'):
+                                    ui.button('Cancel', on_click=p_dialog.close).props('flat')
+                                    ui.button('Save Policy', on_click=save_policy).props('color=primary')
+
+                            p_dialog.open()
+
+                        def _fill_agent_card(entry, agent):
+                            entry["row"] = agent
+                            entry["title"].set_text(f"{agent.hostname} ({agent.id[:8]}...)")
+                            entry["meta"].set_text(f"{agent.platform} | {agent.arch} | {(agent.status or '').upper()}")
+                            entry["card"].classes(
+                                remove=_AGENT_CARD_ALL_BORDERS,
+                                add=_AGENT_CARD_BORDERS.get(agent.status, _AGENT_CARD_OFFLINE)
+                            )
 
                         def refresh_agents_panel():
-                            agents_container.clear()
-                            from app.models.db import Agent
-
-                            db = data_manager.get_db()
-                            try:
-                                agents = db.query(Agent).all()
-                                if not agents:
+                            """Diff the agent list against the rendered cards; only changed agents are touched."""
+                            now = time.monotonic()
+                            if now - agents_snapshot["at"] >= AGENTS_PANEL_TTL:
+                                # Plain Core read on a pooled connection; no Session or identity map to set up
+                                with data_manager.engine.connect() as conn:
+                                    agents_snapshot["rows"] = conn.execute(_LIST_AGENTS).all()
+                                agents_snapshot["at"] = now
+                            agents = {a.id: a for a in agents_snapshot["rows"]}
+
+                            for agent_id in [i for i in agent_cards if i not in agents]:
+                                agents_container.remove(agent_cards.pop(agent_id)["card"])
+
+                            for agent_id, agent in agents.items():
+                                entry = agent_cards.get(agent_id)
+                                if entry is None:
                                     with agents_container:
-                                        ui.label("No agents registered.").classes('italic text-gray-500')
-                                    return
-
-                                for agent in agents:
-                                    with agents_container:
-                                        with ui.card().classes('w-full p-4 border-l-4').classes(
-                                            'border-green-500' if agent.status == 'online' else 'border-gray-400'
-                                        ):
+                                        with ui.card().classes('w-full p-4 border-l-4') as card:
                                             with ui.row().classes('w-full items-center justify-between'):
                                                 with ui.column().classes('gap-0'):
-                                                    ui.label(f"{agent.hostname} ({agent.id[:8]}...)").classes('text-lg font-bold')
-                                                    ui.label(f"{agent.platform} | {agent.arch} | {agent.status.upper()}").classes('text-sm text-gray-500')
-
-                                                def open_policy_dialog(a=agent):
-                                                    current_policy = data_manager.get_agent_policy(a.id)
-
-                                                    with ui.dialog() as p_dialog, ui.card().classes('w-full max-w-2xl'):
-                                                        ui.label(f'Security Policy: {a.hostname}').classes('text-xl font-bold mb-2')
-
-                                                        hitl_switch = ui.switch('Enable Human-in-the-Loop (HITL)', value=current_policy.get('hitl_enabled', False))
-
-                                                        ui.label('Blocked Commands (comma separated)').classes('font-bold mt-2')
-                                                        blocked_input = ui.textarea(value=",".join(current_policy.get('blocked_commands', []))).classes('w-full')
-
-                                                        ui.label('Require Approval For (tools, comma separated)').classes('font-bold mt-2')
-                                                        approval_input = ui.textarea(value=",".join(current_policy.get('requires_approval_for', []))).classes('w-full')
-
-                                                        async def save_policy():
-                                                            new_policy = {
-                                                                "hitl_enabled": hitl_switch.value,
-                                                                "blocked_commands": [x.strip() for x in blocked_input.value.split(',') if x.strip()],
-                                                                "requires_approval_for": [x.strip() for x in approval_input.value.split(',') if x.strip()]
-                                                            }
-                                                            if data_manager.update_agent_policy(a.id, new_policy):
-                                                                from app.core.dependencies import get_agent_manager
-                                                                am = get_agent_manager()
-                                                                await am.sync_policy(a.id, new_policy)
-                                                                ui.notify(f"Policy synced to {a.hostname}", type='positive')
-                                                                p_dialog.close()
-                                                            else:
-                                                                ui.notify("Failed to update policy", type='negative')
-
-                                                        with ui.row().classes('w-full justify-end mt-4'):
-                                                            ui.button('Cancel', on_click=p_dialog.close).props('flat')
-                                                            ui.button('Save Policy', on_click=save_policy).props('color=primary')
-
-                                                    p_dialog.open()
-
-                                                ui.button('Configure Security', icon='security', on_click=open_policy_dialog).props('outline color=primary')
-                            finally:
-                                db.close()
+                                                    title = ui.label().classes('text-lg font-bold')
+                                                    meta = ui.label().classes('text-sm text-gray-500')
+                                                ui.button(
+                                                    'Configure Security', icon='security',
+                                                    on_click=lambda i=agent_id: open_policy_dialog(i)
+                                                ).props('outline color=primary')
+                                    entry = agent_cards[agent_id] = {"card": card, "title": title, "meta": meta}
+                                elif entry["row"] == agent:
+                                    continue
+                                _fill_agent_card(entry, agent)
+
+                            no_agents_label.set_visibility(not agents)
 
                         ui.button('Refresh Agents', icon='refresh', on_click=refresh_agents_panel).props('flat')
-                        refresh_agents_panel()
+                        refresh_agents_panel()  # Agents is the default tab, so it is built up front
 
                     # --- Models Tab ---
-                    with ui.tab_panel(models_tab):
+                    models_panel = ui.tab_panel(models_tab)
+
+                    def render_models_tab():
                         ui.label('GGUF Model Management').classes('text-lg font-bold mb-2')
 
                         with ui.row().classes('w-full items-center gap-2 mb-4'):
@@ -192,6 +363,7 @@ def init_ui():
                             download_progress_row.set_visibility(False)
                             ui.spinner('dots', size='lg')
                             download_progress_label = ui.label('Downloading...').classes('text-sm')
+                            download_progress_bar = ui.linear_progress(value=0, show_value=False).classes('flex-grow')
 
                         models_table = ui.table(
                             columns=[
@@ -202,8 +374,10 @@ def init_ui():
                             ],
                             rows=[],
                             row_key='id',
-                            selection='single'
-                        ).classes('w-full').bind_filter_from(filter_input, 'value')
+                            selection='single',
+                            # rowsNumber puts Quasar in server-side mode: paging and sorting emit 'request'
+                            pagination={'page': 1, 'rowsPerPage': MODELS_PAGE_SIZE, 'rowsNumber': 0}
+                        ).classes('w-full')
 
                         file_select_row = ui.row().classes('w-full items-center gap-2 mt-2')
                         file_select_row.set_visibility(False)
@@ -215,14 +389,62 @@ def init_ui():
                         ui.label('Installed Models').classes('text-lg font-bold mb-2')
                         local_m_container = ui.column().classes('w-full gap-2')
 
+                        # Bumped on every keystroke; a debounced search/filter only runs if it is still current
+                        search_seq = {"n": 0}
+                        filter_seq = {"n": 0}
+                        # Last search result and the subset matching the filter; the table holds one page of it
+                        hf_rows = {"all": [], "filtered": []}
+
+                        def show_models_page(pagination: Optional[dict] = None):
+                            """Sort and slice the filtered results into the table for the requested page."""
+                            page = {**models_table.pagination, **(pagination or {})}
+                            rows = hf_rows["filtered"]
+                            sort_by = page.get('sortBy')
+                            if sort_by:
+                                rows = sorted(
+                                    rows,
+                                    key=lambda r: (r.get(sort_by) or '').lower() if sort_by == 'name' else (r.get(sort_by) or 0),
+                                    reverse=bool(page.get('descending'))
+                                )
+                            per_page = page.get('rowsPerPage') or len(rows) or 1
+                            if (page.get('page', 1) - 1) * per_page >= len(rows):
+                                page['page'] = 1
+                            start = (page['page'] - 1) * per_page
+                            page['rowsNumber'] = len(rows)
+                            models_table.pagination = page
+                            models_table.rows = rows[start:start + per_page]
+                            models_table.update()
+
+                        def apply_models_filter():
+                            text = (filter_input.value or '').strip().lower()
+                            hf_rows["filtered"] = [r for r in hf_rows["all"] if text in r['id'].lower()] if text else hf_rows["all"]
+                            show_models_page({'page': 1})
+
+                        async def on_filter_typed(_):
+                            filter_seq["n"] += 1
+                            seq = filter_seq["n"]
+                            await asyncio.sleep(SEARCH_DEBOUNCE)
+                            if seq == filter_seq["n"]:
+                                apply_models_filter()
+
                         async def refresh_models():
+                            search_seq["n"] += 1  # Supersede any pending debounced search
                             query = search_input.value
                             ui.notify(f'Searching for "{query}"...', type='info')
-                            results = await model_manager.search_hf_models(query)
-                            models_table.rows = results
-                            models_table.update()
+                            hf_rows["all"] = await model_manager.search_hf_models(query)
+                            apply_models_filter()
                             file_select_row.set_visibility(False)
 
+                        async def on_search_typed(e):
+                            """Search once typing pauses for SEARCH_DEBOUNCE seconds."""
+                            search_seq["n"] += 1
+                            seq = search_seq["n"]
+                            if len((e.value or '').strip()) < SEARCH_MIN_CHARS:
+                                return
+                            await asyncio.sleep(SEARCH_DEBOUNCE)
+                            if seq == search_seq["n"]:
+                                await refresh_models()
+
                         async def on_model_select(e):
                             selected = models_table.selected
                             if not selected:
@@ -247,22 +469,70 @@ def init_ui():
                                 return
                             repo_id = selected[0]['id']
                             filename = file_selector.value
+                            flush_storage()
                             hf_token = app.storage.user.get('hf_token', '')
                             if hf_token:
                                 model_manager.set_token(hf_token)
                             download_progress_row.set_visibility(True)
                             download_progress_label.set_text(f'⏳ Downloading {filename} from {repo_id}...')
+                            download_progress_bar.set_value(0)
+
+                            def on_progress(done: int, total: Optional[int]):
+                                if total:
+                                    download_progress_bar.set_value(done / total)
+                                    download_progress_label.set_text(
+                                        f'⏳ Downloading {filename}: {done / 1024**3:.2f} / {total / 1024**3:.2f} GB'
+                                    )
+
                             try:
-                                await model_manager.download_model(repo_id, filename)
+                                await model_manager.download_model(repo_id, filename, progress_cb=on_progress)
                                 ui.notify(f'Download complete: {filename}', type='positive')
-                                refresh_local_models()
+                                await refresh_local_models()
                             except Exception as e:
                                 ui.notify(f'Download failed: {str(e)}', type='negative')
                             download_progress_row.set_visibility(False)
 
-                        def refresh_local_models():
+                        # (name, size) pairs the installed-models list was last rendered from
+                        local_models_sig = {"sig": None}
+
+                        def _load_kwargs() -> dict:
+                            """load_model() options from the current Model Settings."""
+                            flush_storage()
+                            return {
+                                "n_ctx": app.storage.user.get('model_context_size', 4096),
+                                "n_parallel": app.storage.user.get('model_parallel_slots', 1),
+                                "kv_cache_type": app.storage.user.get('model_kv_cache_type', 'fp16'),
+                                "gpu_offload_percent": app.storage.user.get('model_gpu_offload_percent', 100),
+                            }
+
+                        # Shared by every installed-model row; the row's file name is on the clicked button
+                        async def load_local_model(e):
+                            name = e.sender._model_name
+                            ui.notify(f'Loading {name}...', type='info')
+                            try:
+                                await model_manager.load_model(name, **_load_kwargs())
+                                ui.notify(f'Model loaded: {name}', type='positive')
+                                loaded_model_label.set_text(f'🧠 {llm_service.model_name or "No model loaded"}')
+                                release_btn.set_visibility(True)
+                            except Exception as ex:
+                                ui.notify(f'Load failed: {str(ex)}', type='negative')
+
+                        async def delete_local_model(e):
+                            filename = e.sender._model_name
+                            if await asyncio.to_thread(model_manager.delete_model, filename):
+                                ui.notify(f'Deleted {filename}', type='positive')
+                                await refresh_local_models()
+                            else:
+                                ui.notify(f'Failed to delete {filename}', type='negative')
+
+                        async def refresh_local_models():
+                            # Directory scan + stat per file; keep it off the event loop for slow/network disks
+                            local_models = await asyncio.to_thread(model_manager.get_local_models)
+                            sig = tuple((m['name'], m['size']) for m in local_models)
+                            if sig == local_models_sig["sig"]:
+                                return
+                            local_models_sig["sig"] = sig
                             local_m_container.clear()
-                            local_models = model_manager.get_local_models()
                             if not local_models:
                                 with local_m_container:
                                     ui.label('No models installed yet.').classes('text-gray-500 italic')
@@ -276,52 +546,31 @@ def init_ui():
                                                 ui.label(m['name']).classes('font-medium')
                                                 ui.label(f"{m['size']}").classes('text-xs text-gray-500')
                                         with ui.row().classes('gap-2'):
-                                            async def load_m(name=m['name']):
-                                                ui.notify(f'Loading {name}...', type='info')
-                                                try:
-                                                    n_ctx = app.storage.user.get('model_context_size', 4096)
-                                                    n_parallel = app.storage.user.get('model_parallel_slots', 1)
-                                                    kv_cache_type = app.storage.user.get('model_kv_cache_type', 'fp16')
-                                                    gpu_percent = app.storage.user.get('model_gpu_offload_percent', 100)
-                                                    await model_manager.load_model(
-                                                        name,
-                                                        n_ctx=n_ctx,
-                                                        n_parallel=n_parallel,
-                                                        kv_cache_type=kv_cache_type,
-                                                        gpu_offload_percent=gpu_percent
-                                                    )
-                                                    ui.notify(f'Model loaded: {name}', type='positive')
-                                                    loaded_model_label.set_text(f'🧠 {llm_service.model_name or "No model loaded"}')
-                                                    release_btn.set_visibility(True)
-                                                except Exception as e:
-                                                    ui.notify(f'Load failed: {str(e)}', type='negative')
-
-                                            def delete_m(filename=m['name']):
-                                                if model_manager.delete_model(filename):
-                                                    ui.notify(f'Deleted {filename}', type='positive')
-                                                    refresh_local_models()
-                                                else:
-                                                    ui.notify(f'Failed to delete {filename}', type='negative')
-
-                                            ui.button(icon='play_arrow', on_click=load_m).props('flat round color=positive').tooltip('Load Model')
-                                            ui.button(icon='delete', on_click=delete_m).props('flat round color=negative').tooltip('Delete Model')
+                                            load_btn = ui.button(icon='play_arrow', on_click=load_local_model).props('flat round color=positive').tooltip('Load Model')
+                                            delete_btn = ui.button(icon='delete', on_click=delete_local_model).props('flat round color=negative').tooltip('Delete Model')
+                                            load_btn._model_name = delete_btn._model_name = m['name']
 
                         search_input.on('keydown.enter', refresh_models)
+                        search_input.on_value_change(on_search_typed)
                         search_btn.on('click', refresh_models)
+                        filter_input.on_value_change(on_filter_typed)
+                        models_table.on('request', lambda e: show_models_page(e.args['pagination']), ['pagination'])
                         models_table.on('selection', on_model_select)
                         download_btn.on('click', download_selected)
-                        refresh_local_models()
+                        background_tasks.create(refresh_local_models())
                         ui.timer(0.1, lambda: refresh_models() if search_input.value is not None else None, once=True)
 
                     # --- Model Settings Tab ---
-                    with ui.tab_panel(model_settings_tab):
+                    model_settings_panel = ui.tab_panel(model_settings_tab)
+
+                    def render_model_settings_tab():
                         ui.label('Model Configuration').classes('text-lg font-bold mb-4')
                         ui.label('These settings apply when loading a model.').classes('text-sm text-gray-500 mb-4')
 
                         # System Prompt
                         ui.label('System Prompt').classes('font-semibold mt-2')
                         system_prompt_input = ui.textarea(
-                            value=app.storage.user.get('system_prompt', 'You are FabriCore, an autonomous AI agent. You execute commands on remote systems. precise, technical, and do not chat unnecessarily. Use the provided tools to fulfill requests.'),
+                            value=app.storage.user.get('system_prompt', DEFAULT_SYSTEM_PROMPT),
                             placeholder='Enter system prompt...'
                         ).classes('w-full').props('rows=4')
 
@@ -336,8 +585,8 @@ def init_ui():
                         # Context Size
                         ui.label('Context Size (tokens)').classes('font-semibold')
                         def save_context_size(e):
-                            val = e.value if not isinstance(e.value, dict) else 4096
-                            app.storage.user['model_context_size'] = val
+                            val = _coerce(e.value, 4096)
+                            queue_storage('model_context_size', val)
                             ui.notify(f'Context size set to {val}. Reload model to apply.', type='info')
 
                         ui.select(
@@ -352,7 +601,7 @@ def init_ui():
                         # GPU/CPU Toggle
                         ui.label('Hardware Acceleration').classes('font-semibold')
                         def toggle_gpu(e):
-                            app.storage.user['model_use_gpu'] = e.value
+                            queue_storage('model_use_gpu', e.value)
                             ui.notify('GPU enabled. Reload model to apply.' if e.value else 'CPU mode enabled. Reload model to apply.', type='info')
 
                         ui.switch(
@@ -373,7 +622,7 @@ def init_ui():
                                 ui.number(
                                     value=app.storage.user.get('model_parallel_slots', 1),
                                     min=1, max=16, step=1,
-                                    on_change=lambda e: app.storage.user.update({'model_parallel_slots': int(e.value) if not isinstance(e.value, dict) else 1})
+                                    on_change=lambda e: queue_storage('model_parallel_slots', _coerce(e.value, 1, int))
                                 ).classes('w-32')
                                 ui.label('1 = Max VRAM for single chat').classes('text-xs text-gray-500')
 
@@ -381,7 +630,7 @@ def init_ui():
                                 ui.label('GPU Offload').classes('text-sm font-medium')
                                 def update_gpu_percent(e):
                                     val = int(e.value)
-                                    app.storage.user['model_gpu_offload_percent'] = val
+                                    queue_storage('model_gpu_offload_percent', val)
                                     pct_label.set_text(f'{val}%')
 
                                 stored_pct = app.storage.user.get('model_gpu_offload_percent', 100)
@@ -395,7 +644,7 @@ def init_ui():
                                 ui.select(
                                     options=['fp16', 'q8_0', 'q4_0'],
                                     value=app.storage.user.get('model_kv_cache_type', 'fp16'),
-                                    on_change=lambda e: app.storage.user.update({'model_kv_cache_type': e.value if not isinstance(e.value, dict) else 'fp16'})
+                                    on_change=lambda e: queue_storage('model_kv_cache_type', _coerce(e.value, 'fp16'))
                                 ).classes('w-32')
                                 ui.label('Lower precision = more context').classes('text-xs text-gray-500')
 
@@ -408,8 +657,8 @@ def init_ui():
                             ui.label('Temperature:').classes('w-24')
                             temp_label = ui.label(f"{app.storage.user.get('model_temperature', 0.7):.1f}")
                             def update_temp(e):
-                                val = e.value if not isinstance(e.value, dict) else 0.7
-                                app.storage.user['model_temperature'] = val
+                                val = _coerce(e.value, 0.7)
+                                queue_storage('model_temperature', val)
                                 temp_label.set_text(f"{val:.1f}")
                             ui.slider(
                                 min=0.0, max=2.0, step=0.1,
@@ -423,7 +672,7 @@ def init_ui():
                                 value=app.storage.user.get('model_max_tokens', 1024),
                                 min=64, max=16384, step=64
                             ).classes('w-32')
-                            max_tokens_input.on('update:model-value', lambda e: app.storage.user.update({'model_max_tokens': int(e.args)}))
+                            max_tokens_input.on('update:model-value', lambda e: queue_storage('model_max_tokens', int(e.args)), throttle=SETTINGS_INPUT_THROTTLE)
 
                         with ui.row().classes('items-center gap-4 mb-2 mt-2'):
                             ui.label('Top P:').classes('w-24')
@@ -433,9 +682,9 @@ def init_ui():
                             ).classes('w-48')
                             top_p_label = ui.label(f"{app.storage.user.get('model_top_p', 0.95):.2f}")
                             top_p_slider.on('update:model-value', lambda e: (
-                                app.storage.user.update({'model_top_p': e.args}),
+                                queue_storage('model_top_p', e.args),
                                 top_p_label.set_text(f"{e.args:.2f}")
-                            ))
+                            ), throttle=SETTINGS_INPUT_THROTTLE)
 
                         with ui.row().classes('items-center gap-4 mb-2 mt-2'):
                             ui.label('Agent Turns:').classes('w-24')
@@ -443,7 +692,7 @@ def init_ui():
                                 value=app.storage.user.get('agent_max_turns', 15),
                                 min=1, max=50, step=1
                             ).classes('w-32')
-                            turns_input.on('update:model-value', lambda e: app.storage.user.update({'agent_max_turns': int(e.args)}))
+                            turns_input.on('update:model-value', lambda e: queue_storage('agent_max_turns', int(e.args)), throttle=SETTINGS_INPUT_THROTTLE)
                             ui.label('Max steps per request').classes('text-xs text-gray-500')
 
                         ui.separator().classes('my-4')
@@ -456,7 +705,7 @@ def init_ui():
                                         value=app.storage.user.get('model_repeat_penalty', 1.1),
                                         min=1.0, max=2.0, step=0.05, format='%.2f'
                                     ).classes('w-24')
-                                    repeat_penalty.on('update:model-value', lambda e: app.storage.user.update({'model_repeat_penalty': e.args}))
+                                    repeat_penalty.on('update:model-value', lambda e: queue_storage('model_repeat_penalty', e.args), throttle=SETTINGS_INPUT_THROTTLE)
 
                                 with ui.row().classes('items-center gap-4'):
                                     ui.label('Top K:').classes('w-32')
@@ -464,7 +713,7 @@ def init_ui():
                                         value=app.storage.user.get('model_top_k', 40),
                                         min=1, max=100, step=1
                                     ).classes('w-24')
-                                    top_k_input.on('update:model-value', lambda e: app.storage.user.update({'model_top_k': int(e.args)}))
+                                    top_k_input.on('update:model-value', lambda e: queue_storage('model_top_k', int(e.args)), throttle=SETTINGS_INPUT_THROTTLE)
 
                                 with ui.row().classes('items-center gap-4'):
                                     ui.label('Threads:').classes('w-32')
@@ -472,7 +721,7 @@ def init_ui():
                                         value=app.storage.user.get('model_threads', 4),
                                         min=1, max=32, step=1
                                     ).classes('w-24')
-                                    threads_input.on('update:model-value', lambda e: app.storage.user.update({'model_threads': int(e.args)}))
+                                    threads_input.on('update:model-value', lambda e: queue_storage('model_threads', int(e.args)), throttle=SETTINGS_INPUT_THROTTLE)
 
                                 with ui.row().classes('items-center gap-4'):
                                     ui.label('Batch Size:').classes('w-32')
@@ -480,10 +729,12 @@ def init_ui():
                                         value=app.storage.user.get('model_batch_size', 512),
                                         min=32, max=2048, step=32
                                     ).classes('w-24')
-                                    batch_input.on('update:model-value', lambda e: app.storage.user.update({'model_batch_size': int(e.args)}))
+                                    batch_input.on('update:model-value', lambda e: queue_storage('model_batch_size', int(e.args)), throttle=SETTINGS_INPUT_THROTTLE)
 
                     # --- Config Tab ---
-                    with ui.tab_panel(config_tab):
+                    config_panel = ui.tab_panel(config_tab)
+
+                    def render_config_tab():
                         ui.label('API Keys & Settings').classes('text-lg font-bold mb-4')
 
                         hf_token_input = ui.input(
@@ -510,6 +761,23 @@ def init_ui():
 
                         ui.switch('Enable Dark Mode', value=app.storage.user.get('dark_mode', False), on_change=toggle_dark_mode)
 
+                # The other tabs are built the first time they are shown: tab name -> (panel, renderer)
+                lazy_tabs = {
+                    'Models': (models_panel, render_models_tab),
+                    'Model Settings': (model_settings_panel, render_model_settings_tab),
+                    'Performance Guide': (guide_panel, render_guide_tab),
+                    'Configuration': (config_panel, render_config_tab),
+                }
+
+                def ensure_tab(e):
+                    entry = lazy_tabs.pop(e.args, None)
+                    if entry:
+                        panel, render = entry
+                        with panel:
+                            render()
+
+                settings_tabs.on('update:model-value', ensure_tab)
+
         # =====================================================================
         # SCHEDULER DIALOG
         # =====================================================================
@@ -529,19 +797,11 @@ def init_ui():
                 with ui.card().classes('w-full p-4 mb-4 border border-gray-200 dark:border-gray-700'):
                     ui.label("Add New Schedule").classes('text-lg font-bold mb-2')
 
-                    # Build agent dropdown options from DB
-                    from app.models.db import Agent
-                    _sched_db = data_manager.get_db()
-                    try:
-                        _agents = _sched_db.query(Agent).all()
-                        _agent_options = {a.id: f"{a.hostname} ({a.id[:12]}...)" for a in _agents}
-                    finally:
-                        _sched_db.close()
-
                     with ui.grid(columns=2).classes('w-full gap-4'):
                         sched_cron_input = ui.input("Cron Expression", placeholder="*/30 * * * *")
+                        # Options are filled by refresh_schedules_dialog() with the agents it loads
                         sched_agent_input = ui.select(
-                            options=_agent_options,
+                            options={},
                             label="Agent",
                             with_input=True
                         ).tooltip('Select the target agent')
@@ -558,35 +818,38 @@ def init_ui():
                             ui.notify("Cron and Task are required", type="warning")
                             return
 
-                        from app.models.db import Schedule
-                        from app.core.dependencies import get_db as dep_get_db
+                        # Validate before touching the DB; the parsed trigger is reused below
+                        try:
+                            trigger = parse_cron(sched_cron_input.value.strip())
+                        except ValueError as e:
+                            ui.notify(f"Invalid cron expression: {e}", type="warning")
+                            return
+
+                        cron_val = sched_cron_input.value.strip()
+                        task_val = sched_task_input.value
+                        agent_val = sched_agent_input.value or None
+                        if (cron_val, task_val, agent_val or "") in schedule_signatures.values():
+                            ui.notify("Duplicate schedule: the same task already runs on this cron for this agent", type="warning")
+                            return
 
                         try:
-                            db = next(dep_get_db())
                             sch_id = str(uuid.uuid4())
-                            cron_val = sched_cron_input.value
-                            task_val = sched_task_input.value
                             model_val = sched_model_input.value or None
-                            agent_val = sched_agent_input.value or None
                             persistent_val = sched_persistent_switch.value
 
-                            sch = Schedule(
-                                id=sch_id,
-                                cron_expression=cron_val,
-                                task_instruction=task_val,
-                                required_model=model_val,
-                                agent_id=agent_val,
-                                use_persistent_chat=persistent_val
-                            )
-                            db.add(sch)
-                            db.commit()
-                            db.close()
-
-                            # Register with scheduler (use local vars, not detached ORM object)
-                            scheduler_service.add_job(
-                                sch_id, cron_val, task_val,
-                                model_val, agent_val
-                            )
+                            def insert_schedule():
+                                # Commits on success, rolls back and closes on error
+                                with data_manager.SessionLocal.begin() as db:
+                                    db.add(Schedule(
+                                        id=sch_id,
+                                        cron_expression=cron_val,
+                                        task_instruction=task_val,
+                                        required_model=model_val,
+                                        agent_id=agent_val,
+                                        use_persistent_chat=persistent_val
+                                    ))
+
+                            await asyncio.to_thread(insert_schedule)
 
                             ui.notify("Schedule added successfully", type="positive")
                             sched_cron_input.value = ""
@@ -595,6 +858,12 @@ def init_ui():
                             sched_agent_input.value = ""
                             sched_persistent_switch.value = False
                             refresh_schedules_dialog()
+
+                            # Register with scheduler in the background (use local vars, not a
+                            # detached ORM object); the new card's next-run label fills in after
+                            background_tasks.create(_register_schedule(
+                                sch_id, cron_val, task_val, model_val, agent_val, trigger
+                            ))
                         except Exception as e:
                             ui.notify(f"Error adding schedule: {e}", type="negative")
 
@@ -602,74 +871,146 @@ def init_ui():
 
                 ui.separator().classes('my-4')
                 ui.label("Active Schedules").classes('text-lg font-bold mb-2')
-                schedules_list_container = ui.column().classes('w-full gap-2')
+                # One virtual-scrolling table: only visible rows are rendered client-side
+                schedules_table = ui.table(
+                    columns=[
+                        {"name": "cron", "label": "Cron", "field": "cron", "align": "left", "classes": "font-mono font-bold"},
+                        {"name": "task", "label": "Task", "field": "task", "align": "left", "style": "white-space: normal"},
+                        {"name": "agent", "label": "Agent", "field": "agent", "align": "left"},
+                        {"name": "model", "label": "Model", "field": "model", "align": "left"},
+                        {"name": "chat", "label": "Chat", "field": "chat", "align": "left"},
+                        {"name": "next", "label": "Next Run", "field": "next", "align": "left"},
+                        {"name": "actions", "label": "", "field": "id", "align": "right"},
+                    ],
+                    rows=[],
+                    row_key='id'
+                ).props('virtual-scroll flat no-data-label="No active schedules."').classes('w-full').style('max-height: 60vh')
+                schedules_table.add_slot('body-cell-actions', r'''
+                    <q-td :props="props">
+                        <q-btn flat round :icon="props.row.is_active ? 'pause' : 'play_arrow'"
+                               @click="$parent.$emit('toggle', props.row.id)">
+                            <q-tooltip>Pause/Resume</q-tooltip>
+                        </q-btn>
+                        <q-btn flat round color="negative" icon="delete"
+                               @click="$parent.$emit('delete', props.row.id)">
+                            <q-tooltip>Delete</q-tooltip>
+                        </q-btn>
+                    </q-td>
+                ''')
+                schedules_table.on('toggle', lambda e: toggle_schedule(e.args))
+                schedules_table.on('delete', lambda e: delete_schedule(e.args))
+
+        # schedule_id -> (cron, task, agent), to reject duplicates without a query
+        schedule_signatures = {}
+        # Agent map the dropdown options were last built from
+        sched_agent_options = {"source": None}
+        # Set while a debounced refresh_schedules_dialog() is waiting to run
+        sched_refresh = {"pending": False}
+
+        def _schedule_row(s_id: str):
+            """The table row dict for a schedule, or None."""
+            return next((r for r in schedules_table.rows if r["id"] == s_id), None)
+
+        async def _register_schedule(sch_id, cron_val, task_val, model_val, agent_val, trigger):
+            """Add a schedule's APScheduler job off the UI coroutine, then show its next run."""
+            try:
+                await asyncio.to_thread(
+                    scheduler_service.add_job,
+                    sch_id, cron_val, task_val, model_val, agent_val, trigger=trigger
+                )
+            except Exception as e:
+                logger.error(f"Failed to register schedule {sch_id}: {e}")
+                return
+            row = _schedule_row(sch_id)
+            if row:
+                row["next"] = scheduler_service.get_next_run_time(sch_id) or ""
+                schedules_table.update()
+
+        # Row actions, emitted by the table's action slot with the schedule id
+        def toggle_schedule(s_id: str):
+            try:
+                # Flip the flag in the DB and read back what the job needs in one statement
+                with data_manager.SessionLocal.begin() as d_db:
+                    sched = d_db.execute(_TOGGLE_SCHEDULE, {"schedule_id": s_id}).one_or_none()
+                if sched is None:
+                    return
+                job_args = (
+                    s_id, sched.cron_expression, sched.task_instruction,
+                    sched.required_model, sched.agent_id
+                ) if sched.is_active else ()
+                if job_args:
+                    scheduler_service.add_job(*job_args)
+                else:
+                    scheduler_service.remove_job(s_id)
+
+                # Patch just this row
+                row = _schedule_row(s_id)
+                if row:
+                    row["is_active"] = bool(job_args)
+                    row["next"] = scheduler_service.get_next_run_time(s_id) or ""
+                    schedules_table.update()
+            except Exception as ex:
+                ui.notify(f"Error: {ex}", type="negative")
+
+        def delete_schedule(s_id: str):
+            try:
+                with data_manager.SessionLocal.begin() as d_db:
+                    d_db.execute(_DELETE_SCHEDULE, {"schedule_id": s_id})
+                scheduler_service.remove_job(s_id)
+                ui.notify("Schedule deleted", type="info")
+                schedule_signatures.pop(s_id, None)
+                schedules_table.rows[:] = [r for r in schedules_table.rows if r["id"] != s_id]
+                schedules_table.update()
+            except Exception as ex:
+                ui.notify(f"Error deleting: {ex}", type="negative")
 
         def refresh_schedules_dialog():
-            schedules_list_container.clear()
-            from app.models.db import Schedule
-            from app.core.dependencies import get_db as dep_get_db
-
+            """Schedule a refresh on the next UI tick; bursts of calls share one DB + render pass."""
+            if sched_refresh["pending"]:
+                return
+            sched_refresh["pending"] = True
+            with scheduler_dialog:
+                ui.timer(SCHEDULE_REFRESH_DEBOUNCE, _do_refresh_schedules, once=True)
+
+        def _do_refresh_schedules():
+            sched_refresh["pending"] = False
             try:
-                db = next(dep_get_db())
-                schedules = db.query(Schedule).all()
+                # Plain rows with just the rendered columns, read without an ORM Session
+                with data_manager.engine.connect() as conn:
+                    schedules = conn.execute(_LIST_SCHEDULES).all()
+                # Cached agent map serves both the form's dropdown and the schedule labels
+                agents_map = data_manager.get_agent_names()
+
+                if agents_map is not sched_agent_options["source"]:
+                    sched_agent_options["source"] = agents_map
+                    sched_agent_input.set_options(
+                        {a_id: _agent_label(hostname, a_id) for a_id, hostname in agents_map.items()},
+                        value=sched_agent_input.value if sched_agent_input.value in agents_map else None
+                    )
 
-                with schedules_list_container:
-                    if not schedules:
-                        ui.label("No active schedules.").classes('text-gray-500 italic')
-                    else:
-                        for s in schedules:
-                            next_run = scheduler_service.get_next_run_time(s.id)
-                            with ui.card().classes('w-full p-3 border border-gray-200 dark:border-gray-700'):
-                                with ui.row().classes('w-full items-center justify-between'):
-                                    with ui.column().classes('gap-0 flex-grow'):
-                                        ui.label(f"⏱ {s.cron_expression}").classes('font-bold font-mono')
-                                        ui.label(f"{s.task_instruction}").classes('text-sm')
-                                        with ui.row().classes('gap-4'):
-                                            if s.agent_id:
-                                                ui.label(f"Agent: {s.agent_id[:12]}...").classes('text-xs text-gray-500')
-                                            if s.required_model:
-                                                ui.label(f"Model: {s.required_model}").classes('text-xs text-gray-500')
-                                            ui.label(f"{'🔄 Persistent' if s.use_persistent_chat else '🆕 New chat each run'}").classes('text-xs text-blue-500')
-                                            if next_run:
-                                                ui.label(f"Next: {next_run}").classes('text-xs text-green-500')
-
-                                    with ui.row().classes('gap-1'):
-                                        def toggle_active(s_id=s.id, currently_active=s.is_active):
-                                            try:
-                                                d_db = next(dep_get_db())
-                                                sched = d_db.query(Schedule).get(s_id)
-                                                if sched:
-                                                    sched.is_active = not currently_active
-                                                    d_db.commit()
-                                                    if not sched.is_active:
-                                                        scheduler_service.remove_job(s_id)
-                                                    else:
-                                                        scheduler_service.add_job(
-                                                            s_id, sched.cron_expression,
-                                                            sched.task_instruction,
-                                                            sched.required_model, sched.agent_id
-                                                        )
-                                                d_db.close()
-                                                refresh_schedules_dialog()
-                                            except Exception as ex:
-                                                ui.notify(f"Error: {ex}", type="negative")
-
-                                        def delete_schedule(s_id=s.id):
-                                            try:
-                                                d_db = next(dep_get_db())
-                                                d_db.query(Schedule).filter(Schedule.id == s_id).delete()
-                                                d_db.commit()
-                                                d_db.close()
-                                                scheduler_service.remove_job(s_id)
-                                                ui.notify("Schedule deleted", type="info")
-                                                refresh_schedules_dialog()
-                                            except Exception as ex:
-                                                ui.notify(f"Error deleting: {ex}", type="negative")
-
-                                        icon = 'pause' if s.is_active else 'play_arrow'
-                                        ui.button(icon=icon, on_click=toggle_active).props('flat round').tooltip('Pause/Resume')
-                                        ui.button(icon='delete', on_click=delete_schedule).props('flat round color=negative').tooltip('Delete')
-                db.close()
+                next_runs = scheduler_service.get_next_run_times(s.id for s in schedules)
+                schedule_signatures.clear()
+                schedule_signatures.update(
+                    (s.id, (s.cron_expression, s.task_instruction, s.agent_id or "")) for s in schedules
+                )
+                # One rows payload instead of a widget tree per schedule
+                rows = [
+                    {
+                        "id": s.id,
+                        "cron": s.cron_expression,
+                        "task": s.task_instruction,
+                        "agent": _agent_label(agents_map.get(s.agent_id), s.agent_id) if s.agent_id else "",
+                        "model": s.required_model or "",
+                        "chat": '🔄 Persistent' if s.use_persistent_chat else '🆕 New chat each run',
+                        "next": next_runs.get(s.id, ""),
+                        "is_active": bool(s.is_active),
+                    }
+                    for s in schedules
+                ]
+                # Re-opening an unchanged list reuses the rendered rows as they are
+                if rows != schedules_table.rows:
+                    schedules_table.rows[:] = rows
+                    schedules_table.update()
             except Exception as e:
                 ui.notify(f"Error loading schedules: {e}", type="negative")
 
@@ -694,99 +1035,107 @@ def init_ui():
                 ).classes('text-sm text-gray-600 dark:text-gray-400 mb-4')
 
                 hitl_agents_container = ui.column().classes('w-full gap-4')
+                hitl_pending_container = ui.column().classes('w-full gap-2')
 
         def refresh_hitl_dialog():
             hitl_agents_container.clear()
-            from app.models.db import Agent
+            refresh_hitl_pending()
+
+            # Agents and their policies in a single query, rather than one per card
+            agents = data_manager.get_agents_with_policies()
+            with hitl_agents_container:
+                if not agents:
+                    ui.label("No agents registered. Connect an agent first.").classes('italic text-gray-500')
+                    return
+
+                for agent, current_policy in agents:
+                    is_online = agent.status == 'online'
+
+                    with ui.card().classes('w-full p-4 border-l-4').classes(
+                        'border-green-500' if is_online else 'border-gray-400'
+                    ):
+                        with ui.row().classes('w-full items-center justify-between mb-3'):
+                            with ui.column().classes('gap-0'):
+                                ui.label(f"{agent.hostname} ({agent.id[:8]}...)").classes('text-lg font-bold')
+                                ui.label(f"{agent.platform} | {agent.status.upper()}").classes('text-sm text-gray-500')
+
+                            # Status badge
+                            hitl_enabled = current_policy.get('hitl_enabled', False)
+                            status_badge = ui.badge(
+                                'HITL ACTIVE' if hitl_enabled else 'HITL OFF',
+                                color='orange' if hitl_enabled else 'gray'
+                            ).props('outline')
+
+                        # HITL Toggle
+                        hitl_switch = ui.switch(
+                            'Enable Human-in-the-Loop',
+                            value=hitl_enabled
+                        ).classes('mb-2')
+
+                        # Blocked Commands
+                        ui.label('Blocked Commands').classes('font-semibold text-sm mt-2')
+                        ui.label('Commands that will be refused outright (comma separated)').classes('text-xs text-gray-500')
+                        blocked_input = ui.textarea(
+                            value=", ".join(current_policy.get('blocked_commands', [])),
+                            placeholder='rm -rf /, shutdown, reboot...'
+                        ).classes('w-full').props('rows=2')
+
+                        # Approval-Required Tools
+                        ui.label('Require Approval For').classes('font-semibold text-sm mt-2')
+                        ui.label('Tool names that need admin approval before execution (comma separated)').classes('text-xs text-gray-500')
+                        approval_input = ui.textarea(
+                            value=", ".join(current_policy.get('requires_approval_for', [])),
+                            placeholder='run_command, write_file...'
+                        ).classes('w-full').props('rows=2')
+
+                        async def save_hitl_policy(
+                            a_id=agent.id,
+                            a_hostname=agent.hostname,
+                            switch=hitl_switch,
+                            blocked=blocked_input,
+                            approval=approval_input,
+                            badge=status_badge
+                        ):
+                            new_policy = {
+                                "hitl_enabled": switch.value,
+                                "blocked_commands": _parse_csv(blocked.value),
+                                "requires_approval_for": _parse_csv(approval.value)
+                            }
+                            if data_manager.update_agent_policy(a_id, new_policy):
+                                am = get_agent_manager()
+                                await am.sync_policy(a_id, new_policy)
+                                ui.notify(f"✅ Policy synced to {a_hostname}", type='positive')
+                                # Update just this card; the textareas already show the new values
+                                badge.set_text('HITL ACTIVE' if switch.value else 'HITL OFF')
+                                badge.props(f"color={'orange' if switch.value else 'gray'}")
+                                refresh_hitl_pending()
+                            else:
+                                ui.notify("Failed to update policy", type='negative')
+
+                        ui.button(
+                            'Save Policy', icon='save',
+                            on_click=save_hitl_policy
+                        ).props('color=primary outline').classes('mt-3')
+
+        def refresh_hitl_pending():
+            """Re-render only the pending-approvals summary of the HITL dialog."""
+            hitl_pending_container.clear()
 
             db = data_manager.get_db()
             try:
-                agents = db.query(Agent).all()
-                with hitl_agents_container:
-                    if not agents:
-                        ui.label("No agents registered. Connect an agent first.").classes('italic text-gray-500')
-                        return
-
-                    for agent in agents:
-                        current_policy = data_manager.get_agent_policy(agent.id)
-                        is_online = agent.status == 'online'
-
-                        with ui.card().classes('w-full p-4 border-l-4').classes(
-                            'border-green-500' if is_online else 'border-gray-400'
-                        ):
-                            with ui.row().classes('w-full items-center justify-between mb-3'):
+                pending = db.query(PendingApproval).filter(PendingApproval.status == "pending").all()
+                if not pending:
+                    return
+                with hitl_pending_container:
+                    ui.separator().classes('my-4')
+                    ui.label(f'⏳ {len(pending)} Pending Approval(s)').classes('text-lg font-bold text-orange-500')
+                    for p in pending:
+                        with ui.card().classes('w-full p-3 border border-orange-300 dark:border-orange-700 bg-orange-50 dark:bg-orange-900/20'):
+                            with ui.row().classes('w-full items-center justify-between'):
                                 with ui.column().classes('gap-0'):
-                                    ui.label(f"{agent.hostname} ({agent.id[:8]}...)").classes('text-lg font-bold')
-                                    ui.label(f"{agent.platform} | {agent.status.upper()}").classes('text-sm text-gray-500')
-
-                                # Status badge
-                                hitl_enabled = current_policy.get('hitl_enabled', False)
-                                if hitl_enabled:
-                                    ui.badge('HITL ACTIVE', color='orange').props('outline')
-                                else:
-                                    ui.badge('HITL OFF', color='gray').props('outline')
-
-                            # HITL Toggle
-                            hitl_switch = ui.switch(
-                                'Enable Human-in-the-Loop',
-                                value=hitl_enabled
-                            ).classes('mb-2')
-
-                            # Blocked Commands
-                            ui.label('Blocked Commands').classes('font-semibold text-sm mt-2')
-                            ui.label('Commands that will be refused outright (comma separated)').classes('text-xs text-gray-500')
-                            blocked_input = ui.textarea(
-                                value=", ".join(current_policy.get('blocked_commands', [])),
-                                placeholder='rm -rf /, shutdown, reboot...'
-                            ).classes('w-full').props('rows=2')
-
-                            # Approval-Required Tools
-                            ui.label('Require Approval For').classes('font-semibold text-sm mt-2')
-                            ui.label('Tool names that need admin approval before execution (comma separated)').classes('text-xs text-gray-500')
-                            approval_input = ui.textarea(
-                                value=", ".join(current_policy.get('requires_approval_for', [])),
-                                placeholder='run_command, write_file...'
-                            ).classes('w-full').props('rows=2')
-
-                            async def save_hitl_policy(
-                                a_id=agent.id,
-                                a_hostname=agent.hostname,
-                                switch=hitl_switch,
-                                blocked=blocked_input,
-                                approval=approval_input
-                            ):
-                                new_policy = {
-                                    "hitl_enabled": switch.value,
-                                    "blocked_commands": [x.strip() for x in blocked.value.split(',') if x.strip()],
-                                    "requires_approval_for": [x.strip() for x in approval.value.split(',') if x.strip()]
-                                }
-                                if data_manager.update_agent_policy(a_id, new_policy):
-                                    from app.core.dependencies import get_agent_manager
-                                    am = get_agent_manager()
-                                    await am.sync_policy(a_id, new_policy)
-                                    ui.notify(f"✅ Policy synced to {a_hostname}", type='positive')
-                                    refresh_hitl_dialog()
-                                else:
-                                    ui.notify("Failed to update policy", type='negative')
-
-                            ui.button(
-                                'Save Policy', icon='save',
-                                on_click=save_hitl_policy
-                            ).props('color=primary outline').classes('mt-3')
-
-                    # Pending approvals summary
-                    from app.models.db import PendingApproval
-                    pending = db.query(PendingApproval).filter(PendingApproval.status == "pending").all()
-                    if pending:
-                        ui.separator().classes('my-4')
-                        ui.label(f'⏳ {len(pending)} Pending Approval(s)').classes('text-lg font-bold text-orange-500')
-                        for p in pending:
-                            with ui.card().classes('w-full p-3 border border-orange-300 dark:border-orange-700 bg-orange-50 dark:bg-orange-900/20'):
-                                with ui.row().classes('w-full items-center justify-between'):
-                                    with ui.column().classes('gap-0'):
-                                        ui.label(f"Tool: {p.tool_name}").classes('font-bold')
-                                        ui.label(f"Agent: {p.agent_id[:12]}... | Args: {json.dumps(p.arguments)[:60]}...").classes('text-xs text-gray-500')
-                                    ui.label('View in chat →').classes('text-xs text-blue-500 italic')
+                                    ui.label(f"Tool: {p.tool_name}").classes('font-bold')
+                                    ui.label(f"Agent: {p.agent_id[:12]}... | Args: {_dumps(p.arguments)[:60]}...").classes('text-xs text-gray-500')
+                                ui.label('View in chat →').classes('text-xs text-blue-500 italic')
             finally:
                 db.close()
 
@@ -796,12 +1145,19 @@ def init_ui():
 
         async def load_chat(session_id: str):
             """Load messages from a session into the UI."""
-            nonlocal chat_messages, active_session_id, total_tokens_used, context_label, context_bar
+            nonlocal chat_messages, active_session_id, total_tokens_used, context_label, context_bar, oldest_loaded
             active_session_id = session_id
             app.storage.user['current_session_id'] = session_id
 
-            # Mark as read
-            data_manager.mark_session_read(session_id)
+            def read_session():
+                """Mark read, then fetch the newest page and the session's size, in one thread hop."""
+                data_manager.mark_session_read(session_id)
+                return (
+                    data_manager.get_chat_messages(session_id, limit=CHAT_PAGE_SIZE),
+                    data_manager.get_chat_char_count(session_id)
+                )
+
+            messages, char_count = await asyncio.to_thread(read_session)
 
             # Clear UI and local state
             chat_container.clear()
@@ -812,29 +1168,17 @@ def init_ui():
             context_label.set_text(f'{total_tokens_used} / {llm_service.context_size}')
             context_bar.set_value(0.0)
 
-            # Get messages from DB
-            messages = data_manager.get_chat_messages(session_id)
-            for msg in messages:
-                chat_messages.append({"role": msg.role, "content": msg.content})
-
-                content_len = len(msg.content)
-                estimated_tokens = max(1, content_len // 4)
-                total_tokens_used += estimated_tokens
-
-                metadata = msg.metadata_json or {}
+            # Render only the newest page; older messages load on demand
+            oldest_loaded = messages[0].timestamp if messages else None
+            with chat_container:
+                if len(messages) == CHAT_PAGE_SIZE:
+                    _render_load_earlier(session_id)
+                for msg in messages:
+                    chat_messages.append({"role": msg.role, "content": msg.content})
+                    _render_history_message(msg)
 
-                with chat_container:
-                    if metadata.get('type') == 'approval_request':
-                        # Render inline approval card
-                        _render_approval_card(
-                            metadata.get('approval_id'),
-                            msg.content,
-                            metadata.get('status', 'pending')
-                        )
-                    elif msg.role == 'user':
-                        _render_user_message(msg.content)
-                    else:
-                        _render_assistant_message(msg.content)
+            # Estimate tokens for the whole session without loading it
+            total_tokens_used = char_count // 4
 
             # Update context counter
             context_label.set_text(f'{total_tokens_used} / {llm_service.context_size}')
@@ -842,10 +1186,67 @@ def init_ui():
 
             refresh_sessions()
 
-        async def _run_agent_loop(pinned_session_id, pinned_chat_container, pinned_chat_messages, loop_messages):
-            """Core ReAct loop that can be started/resumed."""
+        def _render_history_message(msg):
+            """Render a stored chat message."""
+            metadata = msg.metadata_json or {}
+            if metadata.get('type') == 'approval_request':
+                # Render inline approval card
+                _render_approval_card(
+                    metadata.get('approval_id'),
+                    msg.content,
+                    metadata.get('status', 'pending')
+                )
+            elif msg.role == 'user':
+                _render_user_message(msg.content)
+            else:
+                _render_assistant_message(msg.content)
+
+        def _render_load_earlier(session_id: str):
+            """Button at the top of the chat that prepends the previous page of messages."""
+            button = ui.button(
+                'Load earlier messages', icon='expand_less',
+                on_click=lambda: load_earlier(session_id, button)
+            ).props('flat dense no-caps').classes('self-center text-xs')
+
+        async def load_earlier(session_id: str, button):
+            nonlocal oldest_loaded
+            if session_id != active_session_id or oldest_loaded is None:
+                return
+            older = await asyncio.to_thread(
+                data_manager.get_chat_messages, session_id, CHAT_PAGE_SIZE, oldest_loaded
+            )
+            if older:
+                oldest_loaded = older[0].timestamp
+                children = chat_container.default_slot.children
+                start = len(children)
+                with chat_container:
+                    for msg in older:
+                        _render_history_message(msg)
+                # Move the new rows from the bottom to just below the button
+                for i, element in enumerate(list(children[start:])):
+                    element.move(chat_container, target_index=children.index(button) + 1 + i)
+            if len(older) < CHAT_PAGE_SIZE:
+                button.delete()
+
+        def _loop_settings():
+            """Snapshot the user's generation settings while still in the request context."""
+            flush_storage()
+            return {
+                "temperature": app.storage.user.get('model_temperature', 0.7),
+                "max_tokens": int(app.storage.user.get('model_max_tokens', 1024)),
+                "max_agent_turns": int(app.storage.user.get('agent_max_turns', 15)),
+            }
+
+        async def _run_agent_loop(pinned_session_id, pinned_chat_container, pinned_chat_messages, loop_messages, settings, use_llm_cache=True):
+            """
+            Core ReAct loop that can be started/resumed. Runs as a background task so it
+            outlives the UI event that started it; `settings` comes from _loop_settings().
+            """
             nonlocal total_tokens_used, context_label, context_bar, active_session_id
 
+            # Chat rows produced by this run, written in one commit when it ends
+            pending_writes = []
+
             # Show thinking indicator
             with pinned_chat_container:
                 thinking_row = ui.row().classes('w-full justify-start')
@@ -855,22 +1256,45 @@ def init_ui():
                     thinking_spinner = ui.spinner('dots', size='2em')
 
             try:
-                temperature = app.storage.user.get('model_temperature', 0.7)
-                max_tokens = int(app.storage.user.get('model_max_tokens', 1024))
-                max_agent_turns = int(app.storage.user.get('agent_max_turns', 15))
+                temperature = settings["temperature"]
+                max_tokens = settings["max_tokens"]
+                max_agent_turns = settings["max_agent_turns"]
 
                 # Helper: check if user is still viewing the originating chat
                 def _user_still_here():
                     return active_session_id == pinned_session_id
 
+                # System prompt + tool prompt are fixed for the whole run; build them once
+                prefix = llm_service.get_prefix_handle(loop_messages[0]["content"], TOOL_DEFS)
+
                 # --- AGENT LOOP ---
                 for turn in range(max_agent_turns):
-                    response = await llm_service.generate(
+                    # Rolling window: keep the system prompt plus the latest messages
+                    if len(loop_messages) > LOOP_HISTORY_MAX + 1:
+                        del loop_messages[1:-LOOP_HISTORY_MAX]
+
+                    # Stream the reply into a live bubble while the user is watching
+                    response = None
+                    stream_row = stream_md = None
+                    async for event in llm_service.stream(
                         messages=loop_messages,
-                        tools=get_tool_definitions(),
+                        tools=TOOL_DEFS,
                         max_tokens=max_tokens,
-                        temperature=temperature
-                    )
+                        temperature=temperature,
+                        cache=use_llm_cache,
+                        prefix=prefix
+                    ):
+                        if "result" in event:
+                            response = event["result"]
+                        elif _user_still_here():
+                            try:
+                                if stream_md is None:
+                                    with pinned_chat_container:
+                                        stream_row, stream_md = _render_assistant_message('')
+                                stream_md.set_content(stream_md.content + event["delta"])
+                            except Exception:
+                                pass  # UI elements may be gone if user navigated away
+                            await asyncio.sleep(0)
 
                     content = response["content"]
                     tool_call = response.get("tool_call")
@@ -891,65 +1315,101 @@ def init_ui():
                     if not tool_call:
                         # Final answer — save to DB always, render only if user is still here
                         pinned_chat_messages.append({"role": "assistant", "content": content})
-                        data_manager.save_chat_message(pinned_session_id, 'assistant', content)
+                        pending_writes.append(('assistant', content, None))
 
                         if _user_still_here():
-                            with pinned_chat_container:
-                                _render_assistant_message(content)
+                            if stream_md is not None:
+                                stream_md.set_content(content)
+                            else:
+                                with pinned_chat_container:
+                                    _render_assistant_message(content)
                         else:
-                            data_manager.mark_session_unread(pinned_session_id)
+                            await asyncio.to_thread(data_manager.mark_session_unread, pinned_session_id)
                             refresh_sessions()
                         break
 
-                    # Tool call
-                    tool_msg_content = json.dumps(tool_call)
-                    loop_messages.append({"role": "assistant", "content": tool_msg_content})
+                    # Tool-call turns aren't shown as chat text; drop any streamed preamble
+                    if stream_row is not None:
+                        try:
+                            stream_row.delete()
+                        except (ValueError, RuntimeError):
+                            pass
+
+                    # Tool call(s); independent calls from one reply run concurrently
+                    calls = response.get("tool_calls") or [tool_call]
+                    if len(calls) > 1:
+                        tool_results = await tool_executor.execute_many(
+                            [(tc["tool"], tc.get("params", {})) for tc in calls]
+                        )
+                    else:
+                        tool_results = [await tool_executor.execute(tool_call["tool"], tool_call.get("params", {}))]
+
+                    # Merge observations back in call order. Every call already ran (or paused),
+                    # so all of them are recorded; only the first paused call waits for approval
+                    # and its observation is appended when the loop resumes.
+                    paused_call = None
+                    completed = []
+                    for tc, tool_result in zip(calls, tool_results):
+                        if paused_call is None and isinstance(tool_result, dict) and tool_result.get("status") == "paused":
+                            paused_call = tc
+                            continue
+                        loop_messages.append({"role": "assistant", "content": _dumps(tc)})
+                        loop_messages.append({"role": "system", "content": f"Observation: {_dumps(tool_result)}"})
+                        completed.append((tc["tool"], tool_result))
 
-                    tool_name = tool_call["tool"]
-                    tool_args = tool_call.get("params", {})
+                    # Check for HITL pause
+                    if paused_call:
+                        loop_messages.append({"role": "assistant", "content": _dumps(paused_call)})
+
+                        # Calls from the same reply that already ran: save and show them, so a
+                        # resume rebuilt from the DB doesn't ask for them (and their side effects) again
+                        if completed:
+                            results_content = "🔧 **Completed before approval**\n\n" + "\n".join(
+                                f"- `{name}`: `{_dumps(result)[:200]}`" for name, result in completed
+                            )
+                            pending_writes.append((
+                                'assistant', results_content,
+                                {"type": "tool_results", "results": [
+                                    {"tool": name, "result": result} for name, result in completed
+                                ]}
+                            ))
+                            if _user_still_here():
+                                with pinned_chat_container:
+                                    _render_assistant_message(results_content)
 
-                    tool_result = await tool_executor.execute(tool_name, tool_args)
+                        tool_name = paused_call["tool"]
+                        tool_args = paused_call.get("params", {})
 
-                    # Check for HITL pause
-                    if isinstance(tool_result, dict) and tool_result.get("status") == "paused":
-                        # Generate IDs BEFORE creating ORM object to avoid detached-instance errors
+                        # Generate IDs up front; they are reused for the chat approval card
                         approval_id = str(uuid.uuid4())
                         execution_id = str(uuid.uuid4())
 
-                        from app.models.db import PendingApproval as PA
-                        approval_entry = PA(
-                            id=approval_id,
-                            execution_id=execution_id,
-                            agent_id=tool_args.get("agent_id", "unknown"),
-                            tool_name=tool_name,
-                            arguments=tool_args,
-                            status="pending",
-                            session_id=pinned_session_id
-                        )
-                        from app.core.dependencies import get_db as dep_get_db
-                        db = next(dep_get_db())
-                        db.add(approval_entry)
-                        db.commit()
-                        db.close()
-
-                        # Use local approval_id (not approval_entry.id) to avoid detached-instance error
-                        approval_content = f"🛡️ **Approval Required**\n\nTool: `{tool_name}`\nArgs: `{json.dumps(tool_args)}`"
-                        data_manager.save_chat_message(
-                            pinned_session_id, 'assistant', approval_content,
-                            metadata={"type": "approval_request", "approval_id": approval_id, "status": "pending"}
-                        )
+                        async with data_manager.get_async_db() as s, s.begin():
+                            await s.execute(data_manager.pending_approval_insert(
+                                id=approval_id,
+                                execution_id=execution_id,
+                                agent_id=tool_args.get("agent_id", "unknown"),
+                                tool_name=tool_name,
+                                arguments=tool_args,
+                                status="pending",
+                                session_id=pinned_session_id
+                            ))
+                        paused_loops[approval_id] = loop_messages
+
+                        approval_content = f"🛡️ **Approval Required**\n\nTool: `{tool_name}`\nArgs: `{_dumps(tool_args)}`"
+                        pending_writes.append((
+                            'assistant', approval_content,
+                            {"type": "approval_request", "approval_id": approval_id, "status": "pending"}
+                        ))
 
                         if _user_still_here():
                             with pinned_chat_container:
                                 _render_approval_card(approval_id, approval_content, 'pending')
                         else:
-                            data_manager.mark_session_unread(pinned_session_id)
+                            await asyncio.to_thread(data_manager.mark_session_unread, pinned_session_id)
                             refresh_sessions()
                         break
 
-                    obs_content = f"Observation: {json.dumps(tool_result)}"
-                    loop_messages.append({"role": "system", "content": obs_content})
-
                 else:
                     # Loop exhausted
                     if _user_still_here():
@@ -977,6 +1437,12 @@ def init_ui():
                                 ui.icon('error')
                             with ui.card().classes('bg-red-100 dark:bg-red-900 p-3 rounded-tr-xl rounded-br-xl rounded-bl-xl'):
                                 ui.markdown(f'❌ **Error:** {str(e)}')
+            finally:
+                if pending_writes:
+                    try:
+                        await asyncio.to_thread(data_manager.save_chat_messages_bulk, pinned_session_id, pending_writes)
+                    except Exception as e:
+                        logger.error(f"Failed to save chat messages: {e}")
 
         def _render_user_message(content: str):
             """Render a user message bubble."""
@@ -987,12 +1453,13 @@ def init_ui():
                     ui.icon('person')
 
         def _render_assistant_message(content: str):
-            """Render an assistant message bubble."""
-            with ui.row().classes('w-full justify-start'):
+            """Render an assistant message bubble. Returns (row, markdown) for live updates."""
+            with ui.row().classes('w-full justify-start') as row:
                 with ui.avatar(color='primary', text_color='white'):
                     ui.icon('smart_toy')
                 with ui.card().classes('bg-gray-100 dark:bg-gray-700 p-3 rounded-tr-xl rounded-br-xl rounded-bl-xl'):
-                    ui.markdown(content)
+                    md = ui.markdown(content)
+            return row, md
 
         def _render_approval_card(approval_id: str, content: str, status: str = 'pending'):
             """Render an inline HITL approval card in the chat."""
@@ -1005,18 +1472,17 @@ def init_ui():
                     if status == 'pending' and approval_id:
                         with ui.row().classes('gap-2 mt-3'):
                             async def handle_approve(a_id=approval_id):
-                                from app.models.db import PendingApproval
-                                from app.core.dependencies import get_db as dep_get_db
                                 try:
-                                    db = next(dep_get_db())
-                                    item = db.query(PendingApproval).get(a_id)
+                                    async with data_manager.get_async_db() as s:
+                                        item = await s.get(PendingApproval, a_id)
+                                        if item:
+                                            item.status = "approved"
+                                            await s.commit()
                                     if item:
                                         # Pin session ID locally for resumption
                                         pinned_session_id = item.session_id
                                         pinned_chat_container = chat_container # Reference to latest container
-                                        
-                                        item.status = "approved"
-                                        db.commit()
+
                                         ui.notify(f"Approved {item.tool_name}. Executing...", type='positive')
 
                                         # Execute the tool
@@ -1025,8 +1491,9 @@ def init_ui():
                                                 item.tool_name, item.arguments, approved_by="admin"
                                             )
                                             # Save result to chat
-                                            result_msg = f"✅ **Approved & Executed**: `{item.tool_name}`\n\nResult: ```\n{json.dumps(res, indent=2)}\n```"
-                                            data_manager.save_chat_message(
+                                            result_msg = f"✅ **Approved & Executed**: `{item.tool_name}`\n\nResult: ```\n{_dumps(res, indent=True)}\n```"
+                                            await asyncio.to_thread(
+                                                data_manager.save_chat_message,
                                                 pinned_session_id, 'assistant', result_msg,
                                                 metadata={"type": "approval_result", "approval_id": a_id, "raw_result": res}
                                             )
@@ -1038,60 +1505,71 @@ def init_ui():
                                                     _render_assistant_message(result_msg)
                                             
                                             # RESUME AGENT LOOP
-                                            # 1. Re-construct message history from DB for this session
-                                            history = data_manager.get_chat_messages(pinned_session_id)
-                                            loop_messages = []
+                                            # 1. Continue the paused loop's own history when we still have it;
+                                            #    otherwise (e.g. after a page reload) rebuild it from the DB
+                                            loop_messages = paused_loops.pop(a_id, None)
+                                            if loop_messages is not None:
+                                                loop_messages.append({"role": "system", "content": f"Observation: {_dumps(res)}"})
+                                            else:
+                                                history = await asyncio.to_thread(data_manager.get_chat_messages, pinned_session_id, limit=12)
+                                                loop_messages = []
                                             
-                                            # Add system prompt
-                                            system_prompt = app.storage.user.get('system_prompt', 
-                                                'You are FabriCore, an AI assistant that helps manage computer systems through connected agents. Be concise and helpful. When you need to perform actions, use the available tools.')
-                                            loop_messages.append({"role": "system", "content": system_prompt})
+                                                # Add system prompt
+                                                system_prompt = app.storage.user.get('system_prompt', DEFAULT_SYSTEM_PROMPT)
+                                                loop_messages.append(_system_message(system_prompt))
                                             
-                                            # Build turns for LLM
-                                            for msg in history[-12:]: # Last few messages
-                                                role = msg.role
-                                                content = msg.content
-                                                metadata = getattr(msg, 'metadata_json', {}) or {}
+                                                # Build turns for LLM
+                                                for msg in history: # Last few messages
+                                                    role = msg.role
+                                                    content = msg.content
+                                                    metadata = getattr(msg, 'metadata_json', {}) or {}
                                                 
-                                                # Re-format ReAct turns
-                                                if metadata.get('type') == 'approval_result':
-                                                    role = 'system'
-                                                    raw_res = metadata.get('raw_result')
-                                                    content = f"Observation: {json.dumps(raw_res if raw_res is not None else res)}"
-                                                elif role == 'assistant' and '{"tool":' in content:
-                                                    # It's a tool call assistant message
-                                                    pass # Keep as is
+                                                    # Re-format ReAct turns
+                                                    if metadata.get('type') == 'approval_result':
+                                                        role = 'system'
+                                                        raw_res = metadata.get('raw_result')
+                                                        content = f"Observation: {_dumps(raw_res if raw_res is not None else res)}"
+                                                    elif metadata.get('type') == 'tool_results':
+                                                        role = 'system'
+                                                        content = "\n".join(
+                                                            f"Observation ({r['tool']}): {_dumps(r['result'])}"
+                                                            for r in metadata.get('results', [])
+                                                        )
+                                                    elif role == 'assistant' and '{"tool":' in content:
+                                                        # It's a tool call assistant message
+                                                        pass # Keep as is
                                                 
-                                                loop_messages.append({"role": role, "content": content})
+                                                    loop_messages.append({"role": role, "content": content})
 
-                                            # Start loop
+                                            # Start loop in the background so this handler returns right away
                                             current_msg_list = chat_messages if active_session_id == pinned_session_id else []
                                             
-                                            await _run_agent_loop(
+                                            background_tasks.create(_run_agent_loop(
                                                 pinned_session_id, 
                                                 pinned_chat_container, 
                                                 current_msg_list, 
-                                                loop_messages
-                                            )
+                                                loop_messages,
+                                                _loop_settings(),
+                                                use_llm_cache=False  # Resume after approval must see fresh state
+                                            ))
 
                                         except Exception as e:
                                             ui.notify(f"Execution Failed: {e}", type='negative')
-                                    db.close()
                                 except Exception as ex:
                                     ui.notify(f"Error: {ex}", type='negative')
 
                             async def handle_deny(a_id=approval_id):
-                                from app.models.db import PendingApproval
-                                from app.core.dependencies import get_db as dep_get_db
+                                paused_loops.pop(a_id, None)  # A denied call never resumes
                                 try:
-                                    db = next(dep_get_db())
-                                    item = db.query(PendingApproval).get(a_id)
+                                    async with data_manager.get_async_db() as s:
+                                        item = await s.get(PendingApproval, a_id)
+                                        if item:
+                                            item.status = "rejected"
+                                            await s.commit()
                                     if item:
-                                        item.status = "rejected"
-                                        db.commit()
-
                                         deny_msg = f"❌ **Denied**: `{item.tool_name}` — Action was rejected by admin."
-                                        data_manager.save_chat_message(
+                                        await asyncio.to_thread(
+                                            data_manager.save_chat_message,
                                             item.session_id, 'assistant', deny_msg,
                                             metadata={"type": "approval_result", "approval_id": a_id}
                                         )
@@ -1099,7 +1577,6 @@ def init_ui():
                                             chat_messages.append({"role": "assistant", "content": deny_msg})
                                             with chat_container:
                                                 _render_assistant_message(deny_msg)
-                                    db.close()
                                     ui.notify("Request denied", type='info')
                                 except Exception as ex:
                                     ui.notify(f"Error: {ex}", type='negative')
@@ -1126,14 +1603,24 @@ def init_ui():
                 _render_assistant_message('**New Chat Started.** Ask me anything!')
             refresh_sessions()
 
+        # Bumped by every refresh_sessions(); only the newest query's rows get rendered
+        sessions_seq = {"n": 0}
+
         def refresh_sessions():
-            """Re-render the session list in the drawer with delete buttons and unread indicators."""
+            """Re-render the session list in the drawer; the query runs in a thread, off the event loop."""
+            sessions_seq["n"] += 1
+            background_tasks.create(_render_sessions(sessions_seq["n"]))
+
+        async def _render_sessions(seq: int):
+            """Render the session list with delete buttons and unread indicators."""
+            sessions = await asyncio.to_thread(data_manager.get_chat_session_summaries)
+            if seq != sessions_seq["n"]:
+                return  # A newer refresh is already on its way
             session_list_container.clear()
-            sessions = data_manager.get_chat_sessions()
             with session_list_container:
                 for s in sessions:
                     is_active = (s.id == active_session_id)
-                    has_unread = getattr(s, 'has_unread', False)
+                    has_unread = s.has_unread
 
                     # Session row with hover-reveal delete button
                     with ui.element('div').classes(
@@ -1156,7 +1643,7 @@ def init_ui():
                         # Delete button - only visible on hover (CSS group-hover)
                         async def delete_session(s_id=s.id):
                             nonlocal active_session_id
-                            data_manager.delete_chat_session(s_id)
+                            await asyncio.to_thread(data_manager.delete_chat_session, s_id)
                             if s_id == active_session_id:
                                 start_new_chat()
                             else:
@@ -1227,7 +1714,7 @@ def init_ui():
                     context_bar = ui.linear_progress(value=0.0, show_value=False).props('color=primary size=4px rounded')
 
             # Chat Messages Container
-            chat_container = ui.column().classes('w-full max-w-4xl flex-grow overflow-y-auto p-4 gap-4')
+            chat_container = ui.column().classes('chat-log w-full max-w-4xl flex-grow overflow-y-auto p-4 gap-4')
 
             with chat_container:
                 _render_assistant_message(
@@ -1270,7 +1757,7 @@ def init_ui():
                 # Session: Create if needed
                 if not active_session_id:
                     session_title = msg[:30] + ('...' if len(msg) > 30 else '')
-                    session = data_manager.create_chat_session(title=session_title)
+                    session = await asyncio.to_thread(data_manager.create_chat_session, title=session_title)
                     active_session_id = session.id
                     app.storage.user['current_session_id'] = active_session_id
                     refresh_sessions()
@@ -1282,23 +1769,23 @@ def init_ui():
                 pinned_chat_messages = chat_messages  # reference to current list
 
                 # Save user message
-                data_manager.save_chat_message(pinned_session_id, 'user', msg)
+                await asyncio.to_thread(data_manager.save_chat_message, pinned_session_id, 'user', msg)
 
                 # Prepare initial history for agent
-                system_prompt = app.storage.user.get('system_prompt',
-                    'You are FabriCore, an AI assistant that helps manage computer systems through connected agents. Be concise and helpful. When you need to perform actions, use the available tools.')
+                system_prompt = app.storage.user.get('system_prompt', DEFAULT_SYSTEM_PROMPT)
                 
-                messages = [
-                    {"role": "system", "content": system_prompt}
-                ] + list(pinned_chat_messages[-10:])  # snapshot copy
+                # One snapshot list: system prompt + recent chat
+                loop_messages = [_system_message(system_prompt), *pinned_chat_messages[-10:]]
 
-                # START AGENT LOOP
-                await _run_agent_loop(
+                # START AGENT LOOP in the background: the handler returns right away and a
+                # dropped browser connection no longer cancels the generation
+                background_tasks.create(_run_agent_loop(
                     pinned_session_id,
                     pinned_chat_container,
                     pinned_chat_messages,
-                    messages.copy()
-                )
+                    loop_messages,
+                    _loop_settings()
+                ))
 
             text_input.on('keydown.enter', send_message)
 
@@ -41,7 +41,9 @@ if [ -f "$CONFIG_FILE" ]; then
     # ----------------------------------------------------------
 
     echo "Starting llama-server with args: $ARGS"
-    exec "$BINARY" $ARGS
+    # Parse with shell quoting rules so quoted paths (spaces, quotes) stay intact
+    eval "set -- $ARGS"
+    exec "$BINARY" "$@"
 else
     echo "No config file found at $CONFIG_FILE."
     echo "Waiting for model configuration from the Python server... (Container will remain idle)"